@@ -0,0 +1,207 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+
+
+# The bits of every computation: the "a" bit followed by c1..c6.
+COMP_CODES = {
+    "0": "0101010", "1": "0111111", "-1": "0111010",
+    "D": "0001100", "A": "0110000", "M": "1110000",
+    "!D": "0001101", "!A": "0110001", "!M": "1110001",
+    "-D": "0001111", "-A": "0110011", "-M": "1110011",
+    "D+1": "0011111", "A+1": "0110111", "M+1": "1110111",
+    "D-1": "0001110", "A-1": "0110010", "M-1": "1110010",
+    "D+A": "0000010", "D+M": "1000010",
+    "D-A": "0010011", "D-M": "1010011",
+    "A-D": "0000111", "M-D": "1000111",
+    "D&A": "0000000", "D&M": "1000000",
+    "D|A": "0010101", "D|M": "1010101",
+}
+
+# The shift computations of the extended ALU. Their instructions start with
+# 101 instead of 111.
+SHIFT_CODES = {
+    "A<<": "0100000", "D<<": "0110000", "M<<": "1100000",
+    "A>>": "0000000", "D>>": "0010000", "M>>": "1000000",
+}
+
+# Computations that may be written with their operands swapped.
+COMMUTED = {"A+D": "D+A", "M+D": "D+M", "A&D": "D&A", "M&D": "D&M",
+            "A|D": "D|A", "M|D": "D|M", "1+D": "D+1", "1+A": "A+1",
+            "1+M": "M+1"}
+
+JUMP_CODES = {"": 0, "JGT": 1, "JEQ": 2, "JGE": 3, "JLT": 4, "JNE": 5,
+              "JLE": 6, "JMP": 7}
+
+PREDEFINED_SYMBOLS = {"SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
+                      "SCREEN": 16384, "KBD": 24576,
+                      **{f"R{i}": i for i in range(16)}}
+
+# Variables are allocated in RAM starting at this address.
+FIRST_VARIABLE = 16
+
+# The largest value an A-instruction can load.
+MAX_ADDRESS = 32767
+
+# The number of instructions the ROM holds.
+ROM_SIZE = MAX_ADDRESS + 1
+
+
+def instructions(lines: typing.Iterable[str]) -> typing.Iterator[str]:
+    """
+    Args:
+        lines (typing.Iterable[str]): lines of Hack assembly code.
+
+    Returns:
+        typing.Iterator[str]: the instructions and labels on the lines,
+        without white space and comments.
+    """
+    for line in lines:
+        comment_index = line.find("//")
+        if comment_index != -1:
+            line = line[:comment_index]
+        line = "".join(line.split())
+        if line:
+            yield line
+
+
+def encode_c_instruction(instruction: str) -> int:
+    """
+    Args:
+        instruction (str): a C-instruction, e.g. "AM=M-1" or "D;JGT".
+
+    Returns:
+        int: the machine code of the instruction.
+    """
+    dest, comp, jump = "", instruction, ""
+    if "=" in comp:
+        dest, comp = comp.split("=", 1)
+    if ";" in comp:
+        comp, jump = comp.split(";", 1)
+    comp = COMMUTED.get(comp, comp)
+    if comp in COMP_CODES:
+        prefix, bits = 0b111, COMP_CODES[comp]
+    elif comp in SHIFT_CODES:
+        prefix, bits = 0b101, SHIFT_CODES[comp]
+    else:
+        raise ValueError(f"invalid computation in '{instruction}'")
+    if jump not in JUMP_CODES or set(dest) - set("ADM"):
+        raise ValueError(f"invalid instruction '{instruction}'")
+    dest_bits = 4 * ("A" in dest) + 2 * ("D" in dest) + ("M" in dest)
+    return (prefix << 13) | (int(bits, 2) << 6) | (dest_bits << 3) | \
+        JUMP_CODES[jump]
+
+
+class Assembler:
+    """An integrated two-pass Hack assembler that can stand in for an output
+    file: whatever assembly code is written to it is encoded right away,
+    except for symbolic A-instructions, which are resolved once all labels
+    are known. The symbols follow the standard Hack layout: labels are ROM
+    addresses, and other symbols (such as the statics "Xxx.i") are variables
+    allocated in RAM from address 16 on, in order of first use.
+    """
+
+    def __init__(self) -> None:
+        # The machine code of every instruction, or the symbol of the
+        # A-instructions that still have to be resolved.
+        self.instructions = []
+        # The ROM address of every label.
+        self.labels = {}
+        self.partial = ""
+        # The encoding of every C-instruction seen so far.
+        self.encodings = {}
+
+    def write(self, text: str) -> None:
+        """Assembles code.
+
+        Args:
+            text (str): lines of Hack assembly code. A trailing partial line
+                is kept until the rest of it is written.
+        """
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        self.write_lines(lines)
+
+    def write_lines(self, lines: typing.Iterable[str]) -> None:
+        append = self.instructions.append
+        encodings = self.encodings
+        for instruction in instructions(lines):
+            first = instruction[0]
+            if first == "(":
+                self.labels[instruction[1:-1]] = len(self.instructions)
+            elif first == "@":
+                value = instruction[1:]
+                if value.isdigit():
+                    address = int(value)
+                    if address > MAX_ADDRESS:
+                        raise ValueError(
+                            f"constant too large in '{instruction}'")
+                    append(address)
+                else:
+                    append(value)
+            else:
+                word = encodings.get(instruction)
+                if word is None:
+                    word = encodings[instruction] = \
+                        encode_c_instruction(instruction)
+                append(word)
+
+    def resolve(self) -> typing.List[int]:
+        """Resolves the symbolic A-instructions. Call once everything has
+        been written.
+
+        Returns:
+            typing.List[int]: the machine code of the program.
+        """
+        if self.partial:
+            self.write_lines([self.partial])
+            self.partial = ""
+        symbols = dict(PREDEFINED_SYMBOLS)
+        for label, address in self.labels.items():
+            if address > MAX_ADDRESS:
+                raise ValueError(f"label '{label}' is at {address}, "
+                                 f"beyond the end of the ROM")
+            symbols[label] = address
+        next_variable = FIRST_VARIABLE
+        words = []
+        for instruction in self.instructions:
+            if isinstance(instruction, str):
+                address = symbols.get(instruction)
+                if address is None:
+                    address = symbols[instruction] = next_variable
+                    next_variable += 1
+                instruction = address
+            words.append(instruction)
+        return words
+
+
+def assemble(lines: typing.Iterable[str]) \
+        -> typing.Tuple[typing.List[int], typing.Dict[str, int]]:
+    """Assembles Hack assembly code.
+
+    Args:
+        lines (typing.Iterable[str]): lines of Hack assembly code.
+
+    Returns:
+        typing.Tuple[typing.List[int], typing.Dict[str, int]]: the machine
+        code of the instructions, and the ROM address of every label.
+    """
+    assembler = Assembler()
+    assembler.write_lines(lines)
+    return assembler.resolve(), assembler.labels
+
+
+def to_hack(words: typing.Iterable[int]) -> str:
+    """
+    Args:
+        words (typing.Iterable[int]): machine code.
+
+    Returns:
+        str: the contents of a .hack file: every word in binary, one per line.
+    """
+    return "".join(f"{word:016b}\n" for word in words)
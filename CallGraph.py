@@ -0,0 +1,97 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command, C_FUNCTION, C_CALL
+
+
+# The function that the bootstrap code calls.
+ENTRY_POINT = "Sys.init"
+
+
+class CallGraph:
+    """The call graph of a whole program, built from the "function" and
+    "call" commands of all of its files.
+    """
+
+    def __init__(self) -> None:
+        # The names of the functions each function calls.
+        self.callees = {}
+        # The name of the file each function is defined in, and its commands.
+        self.functions = {}
+
+    def add_file(self, file_name: str,
+                 commands: typing.Iterable[Command]) -> None:
+        """Adds the functions of a .vm file to the graph.
+
+        Args:
+            file_name (str): the name of the file, without its extension.
+            commands (typing.Iterable[Command]): the commands of the file.
+        """
+        function_commands = None
+        callees = None
+        for command in commands:
+            if command.opcode == C_FUNCTION:
+                function_commands = []
+                callees = set()
+                self.functions[command.arg1] = (file_name, function_commands)
+                self.callees[command.arg1] = callees
+            if function_commands is None:
+                continue
+            function_commands.append(command)
+            if command.opcode == C_CALL:
+                callees.add(command.arg1)
+
+    def reachable(self, entry: str = ENTRY_POINT) -> typing.Set[str]:
+        """
+        Args:
+            entry (str): the function the program starts at.
+
+        Returns:
+            typing.Set[str]: the defined functions that may be called when
+            the program starts at entry, including entry itself.
+        """
+        reached = set()
+        pending = [entry]
+        while pending:
+            name = pending.pop()
+            if name in reached or name not in self.callees:
+                continue
+            reached.add(name)
+            pending.extend(self.callees[name])
+        return reached
+
+    def file_functions(self, file_name: str) -> typing.List[str]:
+        """
+        Args:
+            file_name (str): the name of a file, without its extension.
+
+        Returns:
+            typing.List[str]: the functions defined in the file.
+        """
+        return [name for name, (defining_file, commands)
+                in self.functions.items() if defining_file == file_name]
+
+
+def filter_functions(commands: typing.Iterable[Command],
+                     keep: typing.Container[str]) -> typing.Iterator[Command]:
+    """Drops the commands of every function that isn't in keep. Commands
+    before the first function are always kept.
+
+    Args:
+        commands (typing.Iterable[Command]): the commands of a file.
+        keep (typing.Container[str]): the names of the functions to keep.
+
+    Returns:
+        typing.Iterator[Command]: the remaining commands.
+    """
+    keeping = True
+    for command in commands:
+        if command.opcode == C_FUNCTION:
+            keeping = command.arg1 in keep
+        if keeping:
+            yield command
@@ -5,17 +5,275 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import re
 import typing
+from Parser import Command, COMMAND_TYPES, CONDITIONS, C_PUSH, C_POP, \
+    C_FUNCTION
+
+
+# Call sites with at most this many arguments jump straight into a dedicated
+# entry of the shared call routine, so they don't have to pass n_args.
+SHARED_CALL_MAX_ARGS = 7
+
+# Restores the caller's frame and jumps back to it, using R13 and R14 as
+# temporary variables. Used both inline and as the shared $$RETURN routine.
+RETURN_TEMPLATE = ("@LCL\nD=M\n@R13\nM=D\n"
+                   "@R13\nD=M\n@5\nA=D-A\nD=M\n@R14\nM=D\n"
+                   "@SP\nA=M-1\nD=M\n@ARG\nA=M\nM=D\n"
+                   "@ARG\nD=M+1\n@SP\nM=D\n"
+                   "@R13\nD=M\n@1\nD=D-A\nA=D\nD=M\n@THAT\nM=D\n"
+                   "@R13\nD=M\n@2\nD=D-A\nA=D\nD=M\n@THIS\nM=D\n"
+                   "@R13\nD=M\n@3\nD=D-A\nA=D\nD=M\n@ARG\nM=D\n"
+                   "@R13\nD=M\n@4\nD=D-A\nA=D\nD=M\n@LCL\nM=D\n"
+                   "@R14\nA=M\n0;JMP\n")
+
+# Every "_" in a template is replaced by a prefix that is unique to the
+# emitted command, which makes the template's labels unique.
+ARITHMETIC_TEMPLATES = {
+    "add": "@SP\nA=M-1\nD=M\nA=A-1\nD=D+M\nM=D\n@SP\nM=M-1\n",
+    "sub": "@SP\nA=M-1\nD=M\nA=A-1\nD=M-D\nM=D\n@SP\nM=M-1\n",
+    "neg": "@SP\nA=M-1\nM=-M\n",
+    "and": "@SP\nA=M-1\nD=M\nA=A-1\nM=D&M\n@SP\nM=M-1\n",
+    "or": "@SP\nA=M-1\nD=M\nA=A-1\nM=D|M\n@SP\nM=M-1\n",
+    "not": "@SP\nA=M-1\nM=!M\n",
+    "eq": "@SP\nA=M-1\nA=A-1\nD=M\n@_JUMP1\nD;JGE\n@_JUMP2\n0;JMP\n"
+          "(_JUMP1)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JGE\n@_FALSE\n0;JMP\n"
+          "(_JUMP2)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JLT\n@_FALSE\n0;JMP\n"
+          "(F_JUMP)\n@SP\nA=M-1\nD=M\nA=A-1\nD=M-D\n@_TRUE\nD;JEQ\n"
+          "D=0\n@CONTINUE_\n0;JMP\n(_TRUE)\nD=-1\n@CONTINUE_\n0;JMP\n"
+          "(_FALSE)\nD=0\n@CONTINUE_\n0;JMP\n(CONTINUE_)\n@SP\nA=M-1\n"
+          "A=A-1\nM=D\n@SP\nM=M-1\n",
+    "gt": "@SP\nA=M-1\nA=A-1\nD=M\n@_JUMP1\nD;JGE\n@_JUMP2\n0;JMP\n"
+          "(_JUMP1)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JGE\n@_TRUE\n0;JMP\n"
+          "(_JUMP2)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JLT\n@_FALSE\n0;JMP\n"
+          "(F_JUMP)\n@SP\nA=M-1\nD=M\nA=A-1\nD=M-D\n@_TRUE\nD;JGT\n"
+          "D=0\n@CONTINUE_\n0;JMP\n(_TRUE)\nD=-1\n@CONTINUE_\n0;JMP\n"
+          "(_FALSE)\nD=0\n@CONTINUE_\n0;JMP\n(CONTINUE_)\n@SP\nA=M-1\n"
+          "A=A-1\nM=D\n@SP\nM=M-1\n",
+    "lt": "@SP\nA=M-1\nA=A-1\nD=M\n@_JUMP1\nD;JGE\n@_JUMP2\n0;JMP\n"
+          "(_JUMP1)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JGE\n@_FALSE\n0;JMP\n"
+          "(_JUMP2)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JLT\n@_TRUE\n0;JMP\n"
+          "(F_JUMP)\n@SP\nA=M-1\nD=M\nA=A-1\nD=M-D\n@_TRUE\nD;JLT\n"
+          "D=0\n@CONTINUE_\n0;JMP\n(_TRUE)\nD=-1\n@CONTINUE_\n0;JMP\n"
+          "(_FALSE)\nD=0\n@CONTINUE_\n0;JMP\n(CONTINUE_)\n@SP\nA=M-1\n"
+          "A=A-1\nM=D\n@SP\nM=M-1\n",
+    "shiftleft": "@SP\nA=M-1\nM=M<<\n",
+    "shiftright": "@SP\nA=M-1\nM=M>>\n"
+}
+
+# The templates, split at every "_" once, so that emitting a command only
+# joins its parts with its prefix.
+ARITHMETIC_PARTS = {command: template.split("_")
+                    for command, template in ARITHMETIC_TEMPLATES.items()}
+
+# Compares without the sign checks of the templates above, so it may only be
+# used when x-y cannot overflow. "{jump}" is the jump mnemonic of the command.
+FAST_COMPARISON_TEMPLATE = ("@SP\nAM=M-1\nD=M\nA=A-1\nD=M-D\nM=-1\n"
+                            "@_TRUE\nD;{jump}\n@SP\nA=M-1\nM=0\n(_TRUE)\n")
+
+# Jumps into the shared routine of the command, with the return address in D.
+SHARED_COMPARISON_TEMPLATE = "@_RETURN\nD=A\n@$${name}\n0;JMP\n(_RETURN)\n"
+
+FAST_COMPARISON_PARTS = {
+    command: FAST_COMPARISON_TEMPLATE.format(
+        jump="J" + command.upper()).split("_")
+    for command in ("eq", "gt", "lt")}
+SHARED_COMPARISON_PARTS = {
+    command: SHARED_COMPARISON_TEMPLATE.format(
+        name=command.upper()).split("_")
+    for command in ("eq", "gt", "lt")}
+
+# With intern_labels, the labels of the templates are shortened too: the
+# prefix is followed by "." and a letter instead of a word, which keeps them
+# apart from the other interned labels.
+COMPACT_TEMPLATE_LABELS = {"_JUMP1": "_.a", "_JUMP2": "_.b", "F_JUMP": "_.c",
+                           "_TRUE": "_.d", "_FALSE": "_.e", "CONTINUE_": "_.f",
+                           "_RETURN": "_.g", "_XNEG": "_.h", "_SAME": "_.i",
+                           "_END": "_.j"}
+
+
+def compact_labels(template: str) -> str:
+    """
+    Args:
+        template (str): a template whose labels contain "_".
+
+    Returns:
+        str: the template with the labels of COMPACT_TEMPLATE_LABELS.
+    """
+    return re.sub(r"[A-Z]*_[A-Z0-9]*",
+                  lambda match: COMPACT_TEMPLATE_LABELS[match.group()],
+                  template)
+
+
+COMPACT_ARITHMETIC_PARTS = {
+    command: compact_labels(template).split("_")
+    for command, template in ARITHMETIC_TEMPLATES.items()}
+COMPACT_FAST_COMPARISON_PARTS = {
+    command: compact_labels(FAST_COMPARISON_TEMPLATE.format(
+        jump="J" + command.upper())).split("_")
+    for command in ("eq", "gt", "lt")}
+COMPACT_SHARED_COMPARISON_PARTS = {
+    command: compact_labels(SHARED_COMPARISON_TEMPLATE.format(
+        name=command.upper())).split("_")
+    for command in ("eq", "gt", "lt")}
+
+# Stores D on top of the stack.
+PUSH_TAIL = "@SP\nA=M\nM=D\n@SP\nM=M+1\n"
+# Pops the top of the stack into the address in D, using R13.
+POP_TAIL = "@13\nM=D\n@SP\nA=M-1\nD=M\n@13\nA=M\nM=D\n@SP\nM=M-1\n"
+
+SEGMENT_BASES = {"local": "LCL", "argument": "ARG", "this": "THIS",
+                 "that": "THAT"}
+POINTERS = {0: "THIS", 1: "THAT"}
+
+# The push and pop templates of every segment. They are formatted with the
+# index, the pointer it stands for, the file name (for statics) and the code
+# that loads the index into D (for constants).
+PUSH_TEMPLATES = {
+    **{segment: f"@{base}\nD=M\n@{{index}}\nD=D+A\nA=D\nD=M\n" + PUSH_TAIL
+       for segment, base in SEGMENT_BASES.items()},
+    "constant": "{constant}" + PUSH_TAIL,
+    "temp": "@5\nD=A\n@{index}\nA=D+A\nD=M\n" + PUSH_TAIL,
+    "pointer": "@{pointer}\nD=M\n" + PUSH_TAIL,
+    "static": "@{file_name}.{index}\nD=M\n" + PUSH_TAIL,
+}
+POP_TEMPLATES = {
+    **{segment: f"@{base}\nD=M\n@{{index}}\nD=D+A\n" + POP_TAIL
+       for segment, base in SEGMENT_BASES.items()},
+    "temp": "@5\nD=A\n@{index}\nD=D+A\n" + POP_TAIL,
+    "pointer": "@SP\nA=M-1\nD=M\n@{pointer}\nM=D\n@SP\nM=M-1\n",
+    "static": "@SP\nA=M-1\nD=M\n@{file_name}.{index}\nM=D\n@SP\nM=M-1\n",
+}
+
+# Pushes the return address and the caller's frame, repositions ARG and LCL
+# and jumps to the callee.
+CALL_TEMPLATE = ("@{return_label}\nD=A\n" + PUSH_TAIL +
+                 "@LCL\nD=M\n" + PUSH_TAIL +
+                 "@ARG\nD=M\n" + PUSH_TAIL +
+                 "@THIS\nD=M\n" + PUSH_TAIL +
+                 "@THAT\nD=M\n" + PUSH_TAIL +
+                 "@SP\nD=M\n@{n_args}\nD=D-A\n@5\nD=D-A\n@ARG\nM=D\n"
+                 "@SP\nD=M\n@LCL\nM=D\n@{function_name}\n0;JMP\n"
+                 "({return_label})\n")
+
+# Initializes a local variable of a function to 0.
+PUSH_ZERO = "@SP\nA=M\nM=0\n@SP\nM=M+1\n"
+
+# With loop_locals, functions with at least this many local variables
+# initialize them in a loop, which is shorter than that many PUSH_ZEROs.
+LOOP_LOCALS_MIN_VARS = 2
+LOCALS_LOOP_TEMPLATE = ("@{n_vars}\nD=A\n({label})\n@SP\nAM=M+1\nA=A-1\nM=0\n"
+                        "D=D-1\n@{label}\nD;JGT\n")
+
+# With shared_push_pop, pushes and pops of the pointer-based segments jump
+# into the shared $$PUSH.<base> and $$POP.<base> routines. Indexes up to
+# this one have their own entry, so their call sites only pass the return
+# address (in D); other call sites pass it in R15 and the index in D.
+SHARED_PUSH_POP_MAX_INDEX = 3
+SHARED_PUSH_POP_ENTRY_TEMPLATE = ("@{return_label}\nD=A\n@{routine}.{index}\n"
+                                  "0;JMP\n({return_label})\n")
+SHARED_PUSH_POP_TEMPLATE = ("@{return_label}\nD=A\n@R15\nM=D\n@{index}\nD=A\n"
+                            "@{routine}\n0;JMP\n({return_label})\n")
+# The bodies of the shared routines, formatted with the segment's base.
+# Each one expects the index in D and the return address in R15.
+SHARED_PUSH_BODY = ("@{base}\nA=D+M\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n"
+                    "@R15\nA=M\n0;JMP\n")
+SHARED_POP_BODY = ("@{base}\nD=D+M\n@R13\nM=D\n@SP\nAM=M-1\nD=M\n@R13\n"
+                   "A=M\nM=D\n@R15\nA=M\n0;JMP\n")
+
+# With source_map, the code of every command is preceded by this comment,
+# which SourceMap turns into an entry of the source map.
+SOURCE_MARKER = "//#{file_name}:{line}:{command_type}:{segment}:{function}\n"
+
+# With symbol_map, every interned label is preceded by this comment, which
+# SymbolMap turns into an entry of the symbol map.
+SYMBOL_MARKER = "//={label} {name}\n"
+
+# The digits of the numbers in interned labels.
+LABEL_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# The emitted code is buffered, and written to the output stream whenever
+# this many pieces of code have been buffered.
+BUFFER_SIZE = 4096
+
+# Pops x and y and jumps to "{label}" if x-y satisfies "{jump}", so it may
+# only be used when x-y cannot overflow.
+FUSED_COMPARISON_TEMPLATE = ("@SP\nM=M-1\nAM=M-1\nD=M\nA=A+1\nD=D-M\n"
+                             "@{label}\nD;{jump}\n")
+
+# Like the above, but if x and y have different signs, jumps by their signs
+# alone: to "{above}" if x >= 0 > y and to "{below}" if y >= 0 > x. Labels in
+# the arguments are safe from the "_" replacement, since they are formatted
+# in afterwards.
+GUARDED_FUSED_COMPARISON_TEMPLATE = (
+    "@SP\nM=M-1\nAM=M-1\nD=M\n@_XNEG\nD;JLT\n"
+    "@SP\nA=M+1\nD=M\n@_SAME\nD;JGE\n@{above}\n0;JMP\n"
+    "(_XNEG)\n@SP\nA=M+1\nD=M\n@_SAME\nD;JLT\n@{below}\n0;JMP\n"
+    "(_SAME)\n@SP\nA=M\nD=M\nA=A+1\nD=D-M\n@{label}\nD;{jump}\n(_END)\n")
+COMPACT_GUARDED_FUSED_COMPARISON_TEMPLATE = compact_labels(
+    GUARDED_FUSED_COMPARISON_TEMPLATE)
+
+# Applies a binary command to the top of the stack (in M) and a constant (in
+# D), as emitted by write_arithmetic_constant.
+CONSTANT_OPERAND_COMPUTATIONS = {
+    "add": "M=D+M\n",
+    "sub": "M=M-D\n",
+    "and": "M=D&M\n",
+    "or": "M=D|M\n",
+}
+
+# Value ranges of stack entries, used to prove that a comparison can't
+# overflow. Entries whose range is unknown may hold any 16-bit value.
+FULL_RANGE = (-32768, 32767)
+BOOLEAN_RANGE = (-1, 0)
+# Only this many of the topmost entries are tracked, so that long runs of
+# pushes don't make the CodeWriter's memory use grow.
+MAX_TRACKED_RANGES = 16
 
 
 class CodeWriter:
     """Translates VM commands into Hack assembly code."""
 
-    def __init__(self, output_stream: typing.TextIO) -> None:
+    def __init__(self, output_stream: typing.TextIO,
+                 shared_calls: bool = False, shared_compares: bool = False,
+                 fast_compares: bool = False, source_map: bool = False,
+                 hot_lines: typing.Optional[typing.Container[int]] = None,
+                 shared_push_pop: bool = False, loop_locals: bool = False,
+                 intern_labels: bool = False, symbol_map: bool = False) \
+            -> None:
         """Initializes the CodeWriter.
 
         Args:
             output_stream (typing.TextIO): output stream.
+            shared_calls (bool): if True, "call" and "return" jump into the
+                shared $$CALL and $$RETURN routines written by bootstrap()
+                instead of inlining the frame handling at every site.
+            shared_compares (bool): if True, "eq", "gt" and "lt" jump into
+                the shared $$EQ, $$GT and $$LT routines written by
+                bootstrap() instead of inlining the comparison.
+            fast_compares (bool): if True, comparisons that can't overflow
+                are translated to a plain subtraction.
+            source_map (bool): if True, the code of every command written by
+                write_command(s) is preceded by a SOURCE_MARKER comment.
+            hot_lines (typing.Optional[typing.Container[int]]): if given,
+                the lines of the .vm file that run often. Their calls,
+                returns and comparisons are inlined even with shared_calls
+                or shared_compares.
+            shared_push_pop (bool): if True, pushes and pops of local,
+                argument, this and that jump into the shared $$PUSH and
+                $$POP routines written by bootstrap().
+            loop_locals (bool): if True, "function" initializes its local
+                variables in a loop instead of one by one.
+            intern_labels (bool): if True, the labels the CodeWriter
+                generates (the labels of comparisons, return addresses and
+                local initialization loops) get short names, see
+                internal_label. Functions and the labels of "label" keep
+                their names.
+            symbol_map (bool): if True, every interned label is preceded by
+                a SYMBOL_MARKER comment with its original name.
+
+        The code is buffered and written to output_stream in large chunks;
+        call flush() when done.
         """
         # Your code goes here!
         # Note that you can write to output_stream like so:
@@ -25,7 +283,117 @@ class CodeWriter:
         self.current_function = ""
         self.arithmetic_counter = 0
         self.call_counter = 0
+        self.shared_calls = shared_calls
+        self.shared_compares = shared_compares
+        self.fast_compares = fast_compares
+        self.source_map = source_map
+        self.hot_lines = hot_lines
+        self.shared_push_pop = shared_push_pop
+        self.loop_locals = loop_locals
+        self.intern_labels = intern_labels
+        self.symbol_map = symbol_map
+        # The number of labels interned so far.
+        self.interned_labels = 0
+        # The templates with labels, with compact labels if they are
+        # interned.
+        if intern_labels:
+            self.arithmetic_parts = COMPACT_ARITHMETIC_PARTS
+            self.fast_comparison_parts = COMPACT_FAST_COMPARISON_PARTS
+            self.shared_comparison_parts = COMPACT_SHARED_COMPARISON_PARTS
+            self.guarded_template = COMPACT_GUARDED_FUSED_COMPARISON_TEMPLATE
+        else:
+            self.arithmetic_parts = ARITHMETIC_PARTS
+            self.fast_comparison_parts = FAST_COMPARISON_PARTS
+            self.shared_comparison_parts = SHARED_COMPARISON_PARTS
+            self.guarded_template = GUARDED_FUSED_COMPARISON_TEMPLATE
+        # The line of the command being written, if known.
+        self.line = 0
+        # The known value ranges of the topmost stack entries, top last.
+        # Cleared wherever control flow may join, since the ranges are only
+        # valid within straight-line code. Only tracked with fast_compares,
+        # which is the only user of the ranges.
+        self.stack_ranges = []
+        # The pieces of code that were emitted but not written yet.
+        self.buffer = []
+        self.emit = self.buffer.append
+        # The code of every push and pop seen so far, by segment and index.
+        self.push_codes = {}
+        self.pop_codes = {}
+        # The handlers of parsed commands by opcode, each one called with
+        # both arguments of the command.
+        self.handlers = (
+            lambda command, unused: self.write_arithmetic(command),
+            self.write_push,
+            self.write_pop,
+            lambda label, unused: self.write_label(label),
+            lambda label, unused: self.write_goto(label),
+            lambda label, unused: self.write_if(label),
+            self.write_function,
+            lambda unused, unused_too: self.write_return(),
+            self.write_call,
+            self.write_arithmetic_constant,
+            lambda label, condition: self.write_if_comparison(
+                CONDITIONS[condition], label),
+            lambda label, unused: self.write_if_not(label),
+        )
+
+    def write_command(self, command: Command) -> None:
+        """Writes the translation of a parsed command.
+
+        Args:
+            command (Command): the command.
+        """
+        self.line = command.line
+        if self.source_map:
+            self.emit(self.source_marker(command))
+        self.handlers[command.opcode](command.arg1, command.arg2)
+        if len(self.buffer) >= BUFFER_SIZE:
+            self.write_buffer()
+
+    def write_commands(self, commands: typing.Iterable[Command]) -> None:
+        """Writes the translation of parsed commands. Equivalent to calling
+        write_command on each one, but faster.
+
+        Args:
+            commands (typing.Iterable[Command]): the commands.
+        """
+        if self.source_map or self.hot_lines is not None:
+            for command in commands:
+                self.write_command(command)
+            return
+        handlers, buffer = self.handlers, self.buffer
+        for opcode, arg1, arg2, line in commands:
+            handlers[opcode](arg1, arg2)
+            if len(buffer) >= BUFFER_SIZE:
+                self.write_buffer()
 
+    def source_marker(self, command: Command) -> str:
+        """
+        Args:
+            command (Command): a parsed command.
+
+        Returns:
+            str: the SOURCE_MARKER of the command.
+        """
+        opcode = command.opcode
+        return SOURCE_MARKER.format(
+            file_name=self.file_name, line=command.line,
+            command_type=COMMAND_TYPES[opcode],
+            segment=command.arg1 if opcode in (C_PUSH, C_POP) else "",
+            function=command.arg1 if opcode == C_FUNCTION
+            else self.current_function)
+
+    def flush(self) -> None:
+        """Writes the buffered code to the output stream. Call once all
+        commands have been written.
+        """
+        self.write_buffer()
+
+    def write_buffer(self) -> None:
+        """Writes the buffered code to the output stream."""
+        if self.buffer:
+            self.output_stream.write("".join(self.buffer))
+            self.buffer.clear()
 
     def set_file_name(self, filename: str) -> None:
         """Informs the code writer that the translation of a new VM file is
@@ -46,6 +414,12 @@ class CodeWriter:
         # For example, using code similar to:
         # input_filename, input_extension = os.path.splitext(os.path.basename(input_file.name))
         self.file_name = filename
+        # The code of statics depends on the file name.
+        self.push_codes.clear()
+        self.pop_codes.clear()
+        # Until the first function of the file, generated labels are scoped
+        # to the file, so that they can't collide with other files' labels.
+        self.current_function = filename
 
     def write_arithmetic(self, command: str) -> None:
         """Writes assembly code that is the translation of the given
@@ -56,40 +430,258 @@ class CodeWriter:
         Args:
             command (str): an arithmetic command.
         """
-        aritemetic_dictionary = {
-            "add": "@SP\nA=M-1\nD=M\nA=A-1\nD=D+M\nM=D\n@SP\nM=M-1\n",
-            "sub": "@SP\nA=M-1\nD=M\nA=A-1\nD=M-D\nM=D\n@SP\nM=M-1\n",
-            "neg": "@SP\nA=M-1\nM=-M\n",
-            "and": "@SP\nA=M-1\nD=M\nA=A-1\nM=D&M\n@SP\nM=M-1\n",
-            "or": "@SP\nA=M-1\nD=M\nA=A-1\nM=D|M\n@SP\nM=M-1\n",
-            "not": "@SP\nA=M-1\nM=!M\n",
-            "eq": "@SP\nA=M-1\nA=A-1\nD=M\n@_JUMP1\nD;JGE\n@_JUMP2\n0;JMP\n"
-                  "(_JUMP1)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JGE\n@_FALSE\n0;JMP\n"
-                  "(_JUMP2)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JLT\n@_FALSE\n0;JMP\n"
-                  "(F_JUMP)\n@SP\nA=M-1\nD=M\nA=A-1\nD=M-D\n@_TRUE\nD;JEQ\n"
-                  "D=0\n@CONTINUE_\n0;JMP\n(_TRUE)\nD=-1\n@CONTINUE_\n0;JMP\n"
-                  "(_FALSE)\nD=0\n@CONTINUE_\n0;JMP\n(CONTINUE_)\n@SP\nA=M-1\n"
-                  "A=A-1\nM=D\n@SP\nM=M-1\n",
-            "gt": "@SP\nA=M-1\nA=A-1\nD=M\n@_JUMP1\nD;JGE\n@_JUMP2\n0;JMP\n"
-                  "(_JUMP1)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JGE\n@_TRUE\n0;JMP\n"
-                  "(_JUMP2)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JLT\n@_FALSE\n0;JMP\n"
-                  "(F_JUMP)\n@SP\nA=M-1\nD=M\nA=A-1\nD=M-D\n@_TRUE\nD;JGT\n"
-                  "D=0\n@CONTINUE_\n0;JMP\n(_TRUE)\nD=-1\n@CONTINUE_\n0;JMP\n"
-                  "(_FALSE)\nD=0\n@CONTINUE_\n0;JMP\n(CONTINUE_)\n@SP\nA=M-1\n"
-                  "A=A-1\nM=D\n@SP\nM=M-1\n",
-            "lt": "@SP\nA=M-1\nA=A-1\nD=M\n@_JUMP1\nD;JGE\n@_JUMP2\n0;JMP\n"
-                  "(_JUMP1)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JGE\n@_FALSE\n0;JMP\n"
-                  "(_JUMP2)\n@SP\nA=M-1\nD=M\n@F_JUMP\nD;JLT\n@_TRUE\n0;JMP\n"
-                  "(F_JUMP)\n@SP\nA=M-1\nD=M\nA=A-1\nD=M-D\n@_TRUE\nD;JLT\n"
-                  "D=0\n@CONTINUE_\n0;JMP\n(_TRUE)\nD=-1\n@CONTINUE_\n0;JMP\n"
-                  "(_FALSE)\nD=0\n@CONTINUE_\n0;JMP\n(CONTINUE_)\n@SP\nA=M-1\n"
-                  "A=A-1\nM=D\n@SP\nM=M-1\n",
-            "shiftleft": "@SP\nA=M-1\nM=M<<\n",
-            "shiftright": "@SP\nA=M-1\nM=M>>\n"
-        }
-        output = aritemetic_dictionary[command].replace("_", f"{self.current_function}.{str(self.arithmetic_counter)}")
+        if command in ("eq", "gt", "lt"):
+            self.write_comparison(command)
+            return
+        if self.fast_compares:
+            self.track_arithmetic_range(command)
+        # Only the comparisons' templates have labels.
+        self.emit(ARITHMETIC_TEMPLATES[command])
+        self.arithmetic_counter += 1
+
+    def write_comparison(self, command: str) -> None:
+        """Writes assembly code that is the translation of eq, gt or lt.
+        With fast_compares, a plain subtraction is used whenever the value
+        ranges of the operands prove that it can't overflow (this is always
+        the case for eq). With shared_compares, the remaining comparisons
+        jump into the shared routine of the command.
+
+        Args:
+            command (str): "eq", "gt" or "lt".
+        """
+        fast = False
+        if self.fast_compares:
+            y = self.pop_range()
+            x = self.pop_range()
+            self.push_range(BOOLEAN_RANGE)
+            fast = command == "eq" or not self.may_overflow(x, y)
+        if fast:
+            parts = self.fast_comparison_parts[command]
+        elif self.shared_compares and not self.is_hot():
+            parts = self.shared_comparison_parts[command]
+        else:
+            parts = self.arithmetic_parts[command]
+        self.emit(self.label_prefix().join(parts))
+
+    def write_if_comparison(self, condition: str, label: str) -> None:
+        """Writes assembly code that pops two values x and y and jumps to the
+        label if the condition holds between them, without materializing
+        the boolean. Only eq and ne, and with fast_compares the conditions
+        whose operands can't overflow, skip the sign checks.
+
+        Args:
+            condition (str): "eq", "gt", "lt", "ne", "le" or "ge".
+            label (str): the label to go to.
+        """
+        fast = condition in ("eq", "ne")
+        if self.fast_compares:
+            y = self.pop_range()
+            x = self.pop_range()
+            fast = fast or not self.may_overflow(x, y)
+        self.stack_ranges.clear()
+        target = f"{self.current_function}${label}"
+        prefix = self.label_prefix()
+        if fast:
+            template = FUSED_COMPARISON_TEMPLATE
+        else:
+            template = self.guarded_template.replace("_", prefix)
+        end = prefix + (COMPACT_TEMPLATE_LABELS["_END"][1:]
+                        if self.intern_labels else "END")
+        self.emit(template.format(
+            label=target, jump="J" + condition.upper(),
+            above=target if condition in ("gt", "ge") else end,
+            below=target if condition in ("lt", "le") else end))
+
+    def write_if_not(self, label: str) -> None:
+        """Writes assembly code that pops a value and jumps to the label
+        unless it is -1, i.e. "not" followed by "if-goto". Since "not" is
+        bitwise, only -1 makes its result false.
+
+        Args:
+            label (str): the label to go to.
+        """
+        self.stack_ranges.clear()
+        self.emit(
+            f"@SP\nAM=M-1\nD=M\n@{self.current_function}${label}\nD+1;JNE\n")
+
+    def label_prefix(self) -> str:
+        """
+        Returns:
+            str: a new prefix for the labels of the command being written,
+            e.g. the labels of a comparison template.
+        """
+        prefix = self.internal_label(
+            f"{self.current_function}.{self.arithmetic_counter}")
         self.arithmetic_counter += 1
-        self.output_stream.write(output)
+        return prefix
+
+    def return_label(self) -> str:
+        """
+        Returns:
+            str: a new label for the return address of a call site.
+        """
+        label = self.internal_label(
+            f"{self.current_function}$ret.{self.call_counter}")
+        self.call_counter += 1
+        return label
+
+    def internal_label(self, name: str) -> str:
+        """
+        Args:
+            name (str): the name of a label (or label prefix) generated by
+                the CodeWriter, unique in the program.
+
+        Returns:
+            str: the name, or with intern_labels a short name: the file
+            name, "$$" and the number of labels interned by this CodeWriter
+            so far in base 36. It is unique in the program since every file
+            is translated by its own CodeWriter, and neither functions, nor
+            the labels of "label", nor the shared routines can be named like
+            it.
+        """
+        if not self.intern_labels:
+            return name
+        number, digits = self.interned_labels, ""
+        while True:
+            number, digit = divmod(number, len(LABEL_DIGITS))
+            digits = LABEL_DIGITS[digit] + digits
+            if not number:
+                break
+        label = f"{self.file_name}$${digits}"
+        self.interned_labels += 1
+        if self.symbol_map:
+            self.emit(SYMBOL_MARKER.format(label=label, name=name))
+        return label
+
+    def is_hot(self) -> bool:
+        """
+        Returns:
+            bool: whether the command being written is on a hot line.
+        """
+        return self.hot_lines is not None and self.line in self.hot_lines
+
+    @staticmethod
+    def may_overflow(x: typing.Tuple[int, int],
+                     y: typing.Tuple[int, int]) -> bool:
+        """
+        Args:
+            x (typing.Tuple[int, int]): the range of the first operand.
+            y (typing.Tuple[int, int]): the range of the second operand.
+
+        Returns:
+            bool: whether x-y may overflow.
+        """
+        return x[0] - y[1] < FULL_RANGE[0] or x[1] - y[0] > FULL_RANGE[1]
+
+    def write_arithmetic_constant(self, command: str, constant: int) -> None:
+        """Writes assembly code that applies a binary arithmetic command to
+        the value on top of the stack and a constant, in place.
+
+        Args:
+            command (str): "add", "sub", "and" or "or".
+            constant (int): the second operand, a 16-bit signed value.
+        """
+        if self.fast_compares:
+            x = self.pop_range()
+            self.push_range(self.binary_range(command, x,
+                                              (constant, constant)))
+        if command in ("add", "sub") and constant == 1:
+            output = "@SP\nA=M-1\nM=M" + ("+" if command == "add" else "-") \
+                + "1\n"
+        else:
+            output = self.load_constant(constant) + "@SP\nA=M-1\n" + \
+                CONSTANT_OPERAND_COMPUTATIONS[command]
+        self.emit(output)
+
+    @staticmethod
+    def load_constant(constant: int) -> str:
+        """
+        Args:
+            constant (int): a 16-bit signed value.
+
+        Returns:
+            str: assembly code that loads the constant into D. Negative
+            constants are loaded as the complement of a non-negative one.
+        """
+        if constant < 0:
+            return "@" + str(~constant) + "\nD=!A\n"
+        return "@" + str(constant) + "\nD=A\n"
+
+    def push_range(self, value_range: typing.Tuple[int, int]) -> None:
+        """Records the range of a value that was pushed to the stack.
+
+        Args:
+            value_range (typing.Tuple[int, int]): the lowest and highest value
+                the pushed value may have.
+        """
+        self.stack_ranges.append(value_range)
+        if len(self.stack_ranges) > MAX_TRACKED_RANGES:
+            del self.stack_ranges[0]
+
+    def pop_range(self) -> typing.Tuple[int, int]:
+        """Forgets the range of the value on top of the stack.
+
+        Returns:
+            typing.Tuple[int, int]: the range of the popped value.
+        """
+        if self.stack_ranges:
+            return self.stack_ranges.pop()
+        return FULL_RANGE
+
+    def track_arithmetic_range(self, command: str) -> None:
+        """Replaces the ranges of the operands of an arithmetic command other
+        than a comparison with the range of its result.
+
+        Args:
+            command (str): the arithmetic command.
+        """
+        y = self.pop_range()
+        if command in ("neg", "not", "shiftleft", "shiftright"):
+            self.push_range(self.unary_range(command, y))
+        else:
+            self.push_range(self.binary_range(command, self.pop_range(), y))
+
+    def unary_range(self, command: str, y: typing.Tuple[int, int]) \
+            -> typing.Tuple[int, int]:
+        """
+        Args:
+            command (str): a unary arithmetic command.
+            y (typing.Tuple[int, int]): the range of its operand.
+
+        Returns:
+            typing.Tuple[int, int]: the range of the result.
+        """
+        if command == "neg" and y[0] > FULL_RANGE[0]:
+            return -y[1], -y[0]
+        elif command == "not":
+            return ~y[1], ~y[0]
+        elif command == "shiftright":
+            return y[0] >> 1, y[1] >> 1
+        return FULL_RANGE
+
+    def binary_range(self, command: str, x: typing.Tuple[int, int],
+                     y: typing.Tuple[int, int]) -> typing.Tuple[int, int]:
+        """
+        Args:
+            command (str): a binary arithmetic command other than a comparison.
+            x (typing.Tuple[int, int]): the range of the first operand.
+            y (typing.Tuple[int, int]): the range of the second operand.
+
+        Returns:
+            typing.Tuple[int, int]: the range of the result.
+        """
+        if command == "add":
+            low, high = x[0] + y[0], x[1] + y[1]
+        elif command == "sub":
+            low, high = x[0] - y[1], x[1] - y[0]
+        elif command == "and" and (x[0] >= 0 or y[0] >= 0):
+            low, high = 0, max(x[1] if x[0] >= 0 else 0,
+                               y[1] if y[0] >= 0 else 0)
+        else:
+            return FULL_RANGE
+        if low < FULL_RANGE[0] or high > FULL_RANGE[1]:
+            return FULL_RANGE
+        return low, high
 
     def write_push_pop(self, command: str, segment: str, index: int) -> None:
         """Writes assembly code that is the translation of the given
@@ -106,60 +698,68 @@ class CodeWriter:
         # assembly process, the Hack assembler will allocate these symbolic
         # variables to the RAM, starting at address 16.
 
-        # PUSH CONST
         if command == "C_PUSH":
-            if segment == "constant":
-                self.output_stream.write("@" + str(index) + "\nD=A\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
-            elif segment == "local":
-                self.output_stream.write("@LCL\nD=M\n@" + str(index) +
-                                         "\nD=D+A\nA=D\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
-            elif segment == "argument":
-                self.output_stream.write("@ARG\nD=M\n@" + str(index) +
-                                         "\nD=D+A\nA=D\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
-            elif segment == "this":
-                self.output_stream.write("@THIS\nD=M\n@" + str(index) +
-                                         "\nD=D+A\nA=D\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
-            elif segment == "that":
-                self.output_stream.write("@THAT\nD=M\n@" + str(index) +
-                                         "\nD=D+A\nA=D\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
-            elif segment == "temp":
-                self.output_stream.write("@5\nD=A\n@" + str(index) +
-                                         "\nA=D+A\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
-            elif segment == "pointer":
-                if index == "0":
-                    self.output_stream.write("@THIS\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
-                elif index == "1":
-                    self.output_stream.write("@THAT\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
-            elif segment == "static":
-                self.output_stream.write("@" + self.file_name + "."
-                                         + str(index) + "\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n")
-
+            self.write_push(segment, index)
         elif command == "C_POP":
-            if segment == "local":
-                self.output_stream.write("@LCL\nD=M\n@" + str(index) +
-                                         "\nD=D+A\n@13\nM=D\n@SP\nA=M-1\nD=M\n@13\nA=M\nM=D\n@SP\nM=M-1\n")
-            elif segment == "argument":
-                self.output_stream.write("@ARG\nD=M\n@" + str(index) +
-                                         "\nD=D+A\n@13\nM=D\n@SP\nA=M-1\nD=M\n@13\nA=M\nM=D\n@SP\nM=M-1\n")
-            elif segment == "this":
-                self.output_stream.write("@THIS\nD=M\n@" + str(index) +
-                                         "\nD=D+A\n@13\nM=D\n@SP\nA=M-1\nD=M\n@13\nA=M\nM=D\n@SP\nM=M-1\n")
-            elif segment == "that":
-                self.output_stream.write("@THAT\nD=M\n@" + str(index) +
-                                         "\nD=D+A\n@13\nM=D\n@SP\nA=M-1\nD=M\n@13\nA=M\nM=D\n@SP\nM=M-1\n")
-            elif segment == "temp":
-                self.output_stream.write("@5\nD=A\n@" + str(index) +
-                                         "\nD=D+A\n@13\nM=D\n@SP\nA=M-1\nD=M\n@13\nA=M\nM=D\n@SP\nM=M-1\n")
-            elif segment == "pointer":
-                if index == "0":
-                    self.output_stream.write("@SP\nA=M-1\nD=M\n@THIS\nM=D\n"
-                                             "@SP\nM=M-1\n")
-                elif index == "1":
-                    self.output_stream.write("@SP\nA=M-1\nD=M\n@THAT\nM=D\n"
-                                             "@SP\nM=M-1\n")
-            elif segment == "static":
-                self.output_stream.write("@SP\nA=M-1\nD=M\n"
-                                         "@" + self.file_name + "." + str(index) + "\nM=D\n@SP\nM=M-1\n")
+            self.write_pop(segment, index)
+
+    def write_push(self, segment: str, index: int) -> None:
+        """Writes assembly code that is the translation of a push command.
+
+        Args:
+            segment (str): the memory segment to push from.
+            index (int): the index in the memory segment.
+        """
+        if self.fast_compares:
+            self.push_range((index, index) if segment == "constant"
+                            else FULL_RANGE)
+        if self.uses_shared_push_pop(segment):
+            self.write_shared_push_pop("$$PUSH", segment, index)
+            return
+        code = self.push_codes.get((segment, index))
+        if code is None:
+            code = self.push_codes[segment, index] = self.format_push_pop(
+                PUSH_TEMPLATES, segment, index)
+        self.emit(code)
+
+    def write_pop(self, segment: str, index: int) -> None:
+        """Writes assembly code that is the translation of a pop command.
+
+        Args:
+            segment (str): the memory segment to pop to.
+            index (int): the index in the memory segment.
+        """
+        if self.fast_compares:
+            self.pop_range()
+        if self.uses_shared_push_pop(segment):
+            self.write_shared_push_pop("$$POP", segment, index)
+            return
+        code = self.pop_codes.get((segment, index))
+        if code is None:
+            code = self.pop_codes[segment, index] = self.format_push_pop(
+                POP_TEMPLATES, segment, index)
+        self.emit(code)
+
+    def format_push_pop(self, templates: typing.Dict[str, str], segment: str,
+                        index: int) -> str:
+        """
+        Args:
+            templates (typing.Dict[str, str]): PUSH_TEMPLATES or
+                POP_TEMPLATES.
+            segment (str): the memory segment.
+            index (int): the index in the memory segment.
+
+        Returns:
+            str: the code of the push or pop, or nothing if the segment (or
+            the pointer index) doesn't exist.
+        """
+        template = templates.get(segment)
+        if template is None or (segment == "pointer" and
+                                index not in POINTERS):
+            return ""
+        return template.format(
+            index=index, pointer=POINTERS.get(index), file_name=self.file_name,
+            constant=self.load_constant(index) if segment == "constant" else "")
 
     def write_label(self, label: str) -> None:
         """Writes assembly code that affects the label command.
@@ -174,7 +774,8 @@ class CodeWriter:
         """
         # This is irrelevant for project 7,
         # you will implement this in project 8!
-        self.output_stream.write(f"({self.current_function}${label})\n")
+        self.stack_ranges.clear()
+        self.emit(f"({self.current_function}${label})\n")
 
     def write_goto(self, label: str) -> None:
         """Writes assembly code that affects the goto command.
@@ -182,7 +783,8 @@ class CodeWriter:
         Args:
             label (str): the label to go to.
         """
-        self.output_stream.write(
+        self.stack_ranges.clear()
+        self.emit(
             f"@{self.current_function}${label}\n0;JMP\n")
 
     def write_if(self, label: str) -> None:
@@ -195,10 +797,9 @@ class CodeWriter:
         # you will implement this in project 8!
 
         # push the condition value from stack is needed??
-
-        self.output_stream.write(f"@SP\nAM=M-1\nD=M\n")
-        self.output_stream.write(f"@{self.current_function}${label}\n")
-        self.output_stream.write("D;JNE\n")
+        self.stack_ranges.clear()
+        self.emit(f"@SP\nAM=M-1\nD=M\n@{self.current_function}${label}\n"
+                  "D;JNE\n")
 
     def write_function(self, function_name: str, n_vars: int) -> None:
         """Writes assembly code that affects the function command.
@@ -219,9 +820,14 @@ class CodeWriter:
         # repeat n_vars times:  // n_vars = number of local variables
         #   push constant 0     // initializes the local variables to 0
         self.current_function = function_name
-        self.output_stream.write(f"({function_name})\n")
-        for i in range(n_vars):
-            self.output_stream.write("@SP\nA=M\nM=0\n@SP\nM=M+1\n")
+        self.stack_ranges.clear()
+        self.emit(f"({function_name})\n")
+        if self.loop_locals and n_vars >= LOOP_LOCALS_MIN_VARS:
+            self.emit(LOCALS_LOOP_TEMPLATE.format(
+                n_vars=n_vars,
+                label=self.internal_label(f"{function_name}$$INIT")))
+        else:
+            self.emit(PUSH_ZERO * n_vars)
 
     def write_call(self, function_name: str, n_args: int) -> None:
         """Writes assembly code that affects the call command.
@@ -251,17 +857,14 @@ class CodeWriter:
         # LCL = SP              // repositions LCL
         # goto function_name    // transfers control to the callee
         # (return_address)      // injects the return address label into the code
+        self.stack_ranges.clear()
+        if self.shared_calls and not self.is_hot():
+            self.write_shared_call(function_name, n_args)
+            return
 
-        self.output_stream.write(f"@{self.current_function}$ret.{str(self.call_counter)}\n")
-        self.output_stream.write("D=A\n@SP\nA=M\nM=D\n@SP\nM=M+1\n"
-                                 "@LCL\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n"
-                                 "@ARG\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n"
-                                 "@THIS\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n"
-                                 "@THAT\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1\n"
-                                 "@SP\nD=M\n@" + str(n_args) + "\nD=D-A\n@5\nD=D-A\n@ARG\nM=D\n"
-                                                               "@SP\nD=M\n@LCL\nM=D\n@" + function_name +
-                                 "\n0;JMP\n" + "("+self.current_function+"$ret." + str(self.call_counter) + ")\n")
-        self.call_counter += 1
+        self.emit(CALL_TEMPLATE.format(
+            return_label=self.return_label(), n_args=n_args,
+            function_name=function_name))
 
     def write_return(self) -> None:
         """Writes assembly code that affects the return command."""
@@ -277,16 +880,124 @@ class CodeWriter:
         # ARG = *(frame-3)              // restores ARG for the caller
         # LCL = *(frame-4)              // restores LCL for the caller
         # goto return_address           // go to the return address
-        self.output_stream.write("@LCL\nD=M\n@R13\nM=D\n"                
-                                 "@R13\nD=M\n@5\nA=D-A\nD=M\n@R14\nM=D\n"
-                                 "@SP\nA=M-1\nD=M\n@ARG\nA=M\nM=D\n"
-                                 "@ARG\nD=M+1\n@SP\nM=D\n"
-                                 "@R13\nD=M\n@1\nD=D-A\nA=D\nD=M\n@THAT\nM=D\n"
-                                 "@R13\nD=M\n@2\nD=D-A\nA=D\nD=M\n@THIS\nM=D\n"
-                                 "@R13\nD=M\n@3\nD=D-A\nA=D\nD=M\n@ARG\nM=D\n"
-                                 "@R13\nD=M\n@4\nD=D-A\nA=D\nD=M\n@LCL\nM=D\n"
-                                 "@R14\nA=M\n0;JMP\n")
+        self.stack_ranges.clear()
+        if self.shared_calls and not self.is_hot():
+            self.emit("@$$RETURN\n0;JMP\n")
+            return
+        self.emit(RETURN_TEMPLATE)
+
+    def write_shared_call(self, function_name: str, n_args: int) -> None:
+        """Writes a call site that jumps into the shared $$CALL routine.
+        The callee's address is passed in R13 and the return address in D.
+        Calls with up to SHARED_CALL_MAX_ARGS arguments enter "$$CALL.n",
+        other calls pass n_args in R14 and enter "$$CALL".
+
+        Args:
+            function_name (str): the name of the function to call.
+            n_args (int): the number of arguments of the function.
+        """
+        return_label = self.return_label()
+        if n_args <= SHARED_CALL_MAX_ARGS:
+            entry = f"$$CALL.{n_args}"
+        else:
+            entry = "$$CALL"
+            self.emit(f"@{n_args}\nD=A\n@R14\nM=D\n")
+        self.emit(f"@{function_name}\nD=A\n@R13\nM=D\n"
+                  f"@{return_label}\nD=A\n"
+                  f"@{entry}\n0;JMP\n({return_label})\n")
+
+    def uses_shared_push_pop(self, segment: str) -> bool:
+        """
+        Args:
+            segment (str): a memory segment.
+
+        Returns:
+            bool: whether pushes and pops of the segment jump into the shared
+            push and pop routines.
+        """
+        return self.shared_push_pop and segment in SEGMENT_BASES and \
+            not self.is_hot()
+
+    def write_shared_push_pop(self, routine: str, segment: str,
+                              index: int) -> None:
+        """Writes a push or pop site that jumps into a shared routine.
+
+        Args:
+            routine (str): "$$PUSH" or "$$POP".
+            segment (str): local, argument, this or that.
+            index (int): the index in the memory segment.
+        """
+        template = SHARED_PUSH_POP_ENTRY_TEMPLATE \
+            if index <= SHARED_PUSH_POP_MAX_INDEX else SHARED_PUSH_POP_TEMPLATE
+        self.emit(template.format(
+            return_label=self.return_label(),
+            routine=f"{routine}.{SEGMENT_BASES[segment]}", index=index))
+
+    def write_call_routines(self) -> None:
+        """Writes the shared $$CALL and $$RETURN routines used when
+        shared_calls is set. Every entry of $$CALL expects the return address
+        in D and the callee's address in R13; each one stores the return
+        address on the stack, loads n_args into D and continues at
+        $$CALL.FRAME, which saves the caller's frame and jumps to the callee.
+        """
+        self.emit("($$CALL)\n@SP\nA=M\nM=D\n@R14\nD=M\n"
+                  "@$$CALL.FRAME\n0;JMP\n")
+        for n_args in range(SHARED_CALL_MAX_ARGS, 0, -1):
+            self.emit(f"($$CALL.{n_args})\n@SP\nA=M\nM=D\n"
+                      f"@{n_args}\nD=A\n"
+                      "@$$CALL.FRAME\n0;JMP\n")
+        self.emit("($$CALL.0)\n@SP\nA=M\nM=D\nD=0\n"
+                  "($$CALL.FRAME)\n"
+                  "@5\nD=D+A\n@R14\nM=D\n@SP\nM=M+1\n"
+                  "@LCL\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n"
+                  "@ARG\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n"
+                  "@THIS\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n"
+                  "@THAT\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n"
+                  "@R14\nD=M\n@SP\nD=M-D\n@ARG\nM=D\n"
+                  "@SP\nD=M\n@LCL\nM=D\n"
+                  "@R13\nA=M\n0;JMP\n")
+        self.emit("($$RETURN)\n" + RETURN_TEMPLATE)
+
+    def write_compare_routines(self) -> None:
+        """Writes the shared $$EQ, $$GT and $$LT routines used when
+        shared_compares is set. Each one expects its return address in D,
+        keeps it in R15, and replaces the two topmost stack entries with the
+        result of the comparison like the inline template does.
+        """
+        for command in ("eq", "gt", "lt"):
+            name = "$$" + command.upper()
+            self.emit(
+                f"({name})\n@R15\nM=D\n" +
+                ARITHMETIC_TEMPLATES[command].replace("_", name + ".") +
+                "@R15\nA=M\n0;JMP\n")
+
+    def write_push_pop_routines(self) -> None:
+        """Writes the shared $$PUSH.<base> and $$POP.<base> routines used
+        when shared_push_pop is set, for the bases of local, argument, this
+        and that. Every entry "<routine>.<index>" expects the return address
+        in D, stores it in R15 and loads the index into D; entry 0 falls
+        through into the routine itself.
+        """
+        for routine, body in (("$$PUSH", SHARED_PUSH_BODY),
+                              ("$$POP", SHARED_POP_BODY)):
+            for base in SEGMENT_BASES.values():
+                name = f"{routine}.{base}"
+                for index in range(SHARED_PUSH_POP_MAX_INDEX, 0, -1):
+                    self.emit(f"({name}.{index})\n@R15\nM=D\n@{index}\nD=A\n"
+                              f"@{name}\n0;JMP\n")
+                self.emit(f"({name}.0)\n@R15\nM=D\nD=0\n({name})\n" +
+                          body.format(base=base))
 
     def bootstrap(self):
-        self.output_stream.write("@256\nD=A\n@SP\nM=D\n")
+        """Writes the bootstrap code: sets SP to 256 and calls Sys.init. When
+        shared_calls, shared_compares or shared_push_pop are set, the shared
+        routines are written right after it, since Sys.init never returns.
+        """
+        self.emit("@256\nD=A\n@SP\nM=D\n")
         self.write_call("Sys.init", 0)
+        if self.shared_calls:
+            self.write_call_routines()
+        if self.shared_compares:
+            self.write_compare_routines()
+        if self.shared_push_pop:
+            self.write_push_pop_routines()
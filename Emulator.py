@@ -0,0 +1,242 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import argparse
+import array
+import collections
+import os
+import re
+import typing
+from Assembler import assemble, COMP_CODES, SHIFT_CODES
+
+
+# Every computation of the ALU, on signed 16-bit values. Results are wrapped
+# to 16 bits by the emulator.
+COMPUTATIONS = {
+    "0": lambda a, d, m: 0,
+    "1": lambda a, d, m: 1,
+    "-1": lambda a, d, m: -1,
+    "D": lambda a, d, m: d,
+    "A": lambda a, d, m: a,
+    "M": lambda a, d, m: m,
+    "!D": lambda a, d, m: ~d,
+    "!A": lambda a, d, m: ~a,
+    "!M": lambda a, d, m: ~m,
+    "-D": lambda a, d, m: -d,
+    "-A": lambda a, d, m: -a,
+    "-M": lambda a, d, m: -m,
+    "D+1": lambda a, d, m: d + 1,
+    "A+1": lambda a, d, m: a + 1,
+    "M+1": lambda a, d, m: m + 1,
+    "D-1": lambda a, d, m: d - 1,
+    "A-1": lambda a, d, m: a - 1,
+    "M-1": lambda a, d, m: m - 1,
+    "D+A": lambda a, d, m: d + a,
+    "D+M": lambda a, d, m: d + m,
+    "D-A": lambda a, d, m: d - a,
+    "D-M": lambda a, d, m: d - m,
+    "A-D": lambda a, d, m: a - d,
+    "M-D": lambda a, d, m: m - d,
+    "D&A": lambda a, d, m: d & a,
+    "D&M": lambda a, d, m: d & m,
+    "D|A": lambda a, d, m: d | a,
+    "D|M": lambda a, d, m: d | m,
+    "A<<": lambda a, d, m: a << 1,
+    "D<<": lambda a, d, m: d << 1,
+    "M<<": lambda a, d, m: m << 1,
+    "A>>": lambda a, d, m: a >> 1,
+    "D>>": lambda a, d, m: d >> 1,
+    "M>>": lambda a, d, m: m >> 1,
+}
+
+# Maps the top three bits and the a and c bits of a C-instruction to its
+# computation.
+DECODED_COMPUTATIONS = {
+    **{(0b111, int(bits, 2)): comp for comp, bits in COMP_CODES.items()},
+    **{(0b101, int(bits, 2)): comp for comp, bits in SHIFT_CODES.items()},
+}
+
+# Whether each jump is taken, when the result is negative, zero or positive.
+JUMPS = [(bool(jump & 4), bool(jump & 2), bool(jump & 1))
+         for jump in range(8)]
+
+# Marks an instruction that jumps to the A-instruction right before it,
+# which loads the address of itself: the program has halted.
+HALT = -1
+
+RAM_SIZE = 32768
+ADDRESS_MASK = 0x7FFF
+
+DEFAULT_MAX_CYCLES = 100_000_000
+
+# The labels that write_function and the shared routines emit. Every other
+# label belongs to the function (or routine) whose label precedes it.
+FUNCTION_LABEL = re.compile(r"^[A-Za-z_]\w*\.[A-Za-z_]\w*$|^\$\$[A-Z]+$")
+# The entries of the shared call, push and pop routines ($$CALL.<n>,
+# $$CALL.FRAME, $$PUSH.<base>.<index>, ...), which count as their routine:
+# $$CALL, $$PUSH.<base> or $$POP.<base>. The labels inside $$EQ, $$GT and
+# $$LT don't match, so they still count as their routine.
+ROUTINE_ENTRY_LABEL = re.compile(
+    r"^(\$\$CALL|\$\$(?:PUSH|POP)\.[A-Z]+)(?:\.[A-Z0-9]+)?$")
+
+# Code before the first function, i.e. the bootstrap code.
+BOOTSTRAP = "(bootstrap)"
+
+
+class Emulator:
+    """A headless Hack CPU. Every instruction is decoded once, up front, and
+    the RAM is an array of signed 16-bit words, so running a program doesn't
+    parse anything. Counts the cycles spent at every ROM address, which
+    gives the cycles spent in every function.
+    """
+
+    def __init__(self, words: typing.List[int],
+                 labels: typing.Optional[typing.Dict[str, int]] = None) \
+            -> None:
+        """Loads a program.
+
+        Args:
+            words (typing.List[int]): the machine code of the program.
+            labels (typing.Optional[typing.Dict[str, int]]): the ROM address
+                of every label, used to attribute cycles to functions.
+        """
+        self.rom = array.array("H", words)
+        self.labels = labels or {}
+        self.program = [self.decode(address) for address in range(len(words))]
+        self.ram = array.array("h", bytes(2 * RAM_SIZE))
+        self.counts = array.array("Q", bytes(8 * len(words)))
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+
+    def decode(self, address: int) -> typing.Tuple:
+        """
+        Args:
+            address (int): the ROM address of an instruction.
+
+        Returns:
+            typing.Tuple: (None, value) for an A-instruction, otherwise
+            (computation, reads M, destination bits, jump bits or HALT).
+        """
+        word = self.rom[address]
+        if not word & 0x8000:
+            return None, word, 0, 0
+        comp = DECODED_COMPUTATIONS.get((word >> 13, (word >> 6) & 0x7F))
+        if comp is None:
+            raise ValueError(f"invalid instruction {word:016b} at {address}")
+        jump = word & 7
+        if jump == 7 and not word & 0b100000 and address > 0 and \
+                self.rom[address - 1] == address - 1:
+            jump = HALT
+        return COMPUTATIONS[comp], "M" in comp, (word >> 3) & 7, jump
+
+    def run(self, max_cycles: int = DEFAULT_MAX_CYCLES) -> int:
+        """Runs the program until it halts, runs past the end of the ROM or
+        max_cycles more cycles have passed.
+
+        Args:
+            max_cycles (int): the maximal number of cycles to run.
+
+        Returns:
+            int: the total number of cycles run so far.
+        """
+        program, ram, counts = self.program, self.ram, self.counts
+        jumps = JUMPS
+        a, d, pc = self.a, self.d, self.pc
+        size = len(program)
+        cycles = 0
+        while cycles < max_cycles and pc < size:
+            counts[pc] += 1
+            cycles += 1
+            compute, operand, dest, jump = program[pc]
+            if compute is None:
+                a = operand
+                pc += 1
+                continue
+            value = compute(a, d, ram[a & ADDRESS_MASK] if operand else 0)
+            value = ((value + 0x8000) & 0xFFFF) - 0x8000
+            if dest & 1:
+                ram[a & ADDRESS_MASK] = value
+            if dest & 4:
+                a = value
+            if dest & 2:
+                d = value
+            if jump == HALT:
+                self.halted = True
+                break
+            if jump and jumps[jump][(value >= 0) + (value > 0)]:
+                pc = a & ADDRESS_MASK
+            else:
+                pc += 1
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return self.cycles
+
+    def profile(self) -> typing.List[typing.Tuple[str, int]]:
+        """
+        Returns:
+            typing.List[typing.Tuple[str, int]]: the cycles spent in every
+            function, most expensive first.
+        """
+        starts = []
+        for name, address in self.labels.items():
+            entry = ROUTINE_ENTRY_LABEL.match(name)
+            if entry:
+                starts.append((address, entry.group(1)))
+            elif FUNCTION_LABEL.match(name):
+                starts.append((address, name))
+        starts.sort()
+        cycles = collections.Counter()
+        function = BOOTSTRAP
+        next_start = 0
+        for address, count in enumerate(self.counts):
+            while next_start < len(starts) and \
+                    starts[next_start][0] <= address:
+                function = starts[next_start][1]
+                next_start += 1
+            if count:
+                cycles[function] += count
+        return cycles.most_common()
+
+
+def load(path: str) -> typing.Tuple[typing.List[int],
+                                    typing.Dict[str, int]]:
+    """
+    Args:
+        path (str): a .asm file, or a .hack file of binary machine code.
+
+    Returns:
+        typing.Tuple[typing.List[int], typing.Dict[str, int]]: the machine
+        code, and the ROM address of every label (none for .hack files).
+    """
+    with open(path, "r") as program_file:
+        if os.path.splitext(path)[1].lower() == ".hack":
+            return [int(line, 2) for line in program_file.read().split()], {}
+        return assemble(program_file)
+
+
+if "__main__" == __name__:
+    # Runs a program and reports its cycles, ROM size and the cycles spent
+    # in every function.
+    arg_parser = argparse.ArgumentParser(prog="Emulator")
+    arg_parser.add_argument("program", help="a .asm or .hack file")
+    arg_parser.add_argument(
+        "--cycles", type=int, default=DEFAULT_MAX_CYCLES,
+        help="stop after this many cycles if the program hasn't halted")
+    arg_parser.add_argument(
+        "--top", type=int, default=20,
+        help="report this many of the most expensive functions")
+    args = arg_parser.parse_args()
+    emulator = Emulator(*load(args.program))
+    emulator.run(args.cycles)
+    print(f"cycles: {emulator.cycles}"
+          f"{'' if emulator.halted else ' (did not halt)'}")
+    print(f"ROM size: {len(emulator.rom)} instructions")
+    for name, cycles in emulator.profile()[:args.top]:
+        print(f"{cycles:>12} {100 * cycles / emulator.cycles:6.2f}% {name}")
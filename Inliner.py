@@ -0,0 +1,284 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import typing
+from CallGraph import CallGraph
+from Parser import Command, C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, \
+    C_IF, C_FUNCTION, C_RETURN, C_CALL
+
+
+# Functions with at most this many commands (not counting "function") are
+# inlined by default.
+DEFAULT_MAX_SIZE = 8
+
+UNARY_COMMANDS = ("neg", "not", "shiftleft", "shiftright")
+
+
+class Callee(typing.NamedTuple):
+    """What the Inliner needs to know about a function it may inline."""
+    # The file the function is defined in.
+    file_name: str
+    # The commands of the function, without "function".
+    body: typing.List[Command]
+    n_vars: int
+    # The number of arguments the function reads or writes.
+    n_args: int
+    # The pointer entries (0 for THIS, 1 for THAT) the function writes, which
+    # a call would restore on return.
+    pointers: typing.Tuple[int, ...]
+    uses_statics: bool
+
+
+def stack_depths_balance(body: typing.List[Command]) -> bool:
+    """
+    Args:
+        body (typing.List[Command]): the commands of a function without
+            calls, without "function".
+
+    Returns:
+        bool: True if the function never pops below its own stack, the
+        stack has the same depth whenever a label is reached, exactly the
+        return value is on the stack at every "return" and control never
+        runs past the last command.
+    """
+    label_depths = {}
+    depth = 0
+    for command in body:
+        opcode = command.opcode
+        if opcode == C_LABEL:
+            if depth is None:
+                depth = label_depths.get(command.arg1)
+                if depth is None:
+                    # Only reached by jumps further down.
+                    return False
+            elif label_depths.setdefault(command.arg1, depth) != depth:
+                return False
+            continue
+        if depth is None:
+            # Dead code.
+            continue
+        if opcode == C_PUSH:
+            depth += 1
+        elif opcode in (C_POP, C_IF):
+            depth -= 1
+        elif opcode == C_ARITHMETIC and command.arg1 not in UNARY_COMMANDS:
+            depth -= 1
+        if depth < 0:
+            return False
+        if opcode in (C_GOTO, C_IF):
+            if label_depths.setdefault(command.arg1, depth) != depth:
+                return False
+        if opcode == C_RETURN:
+            if depth != 1:
+                return False
+            depth = None
+        elif opcode == C_GOTO:
+            depth = None
+    labels = {command.arg1 for command in body if command.opcode == C_LABEL}
+    return depth is None and label_depths.keys() <= labels
+
+
+class Inliner:
+    """Substitutes small leaf functions at their call sites, in the parsed
+    commands of a whole program.
+
+    A function is inlined if it has at most max_size commands, calls no
+    function (so it can't be recursive), only uses the locals it declares
+    and its stack is balanced at every label and "return". Its arguments,
+    its locals and the pointer entries it writes are kept in extra locals of
+    the caller: the arguments are popped into them, the locals are set to 0,
+    and the pointers are saved before the body and restored at every
+    "return", which becomes a "goto" to the end of the body. Labels are
+    renamed to "callee$n$label", which the CodeWriter scopes to the caller
+    like any other label.
+
+    Statics belong to the file they are used in, so functions that use them
+    are only inlined into functions of their own file.
+    """
+
+    def __init__(self, call_graph: CallGraph,
+                 max_size: int = DEFAULT_MAX_SIZE,
+                 hot_lines: typing.Optional[typing.Dict[
+                     str, typing.Container[int]]] = None) -> None:
+        """
+        Args:
+            call_graph (CallGraph): the call graph of the whole program.
+            max_size (int): the maximal number of commands of an inlined
+                function, not counting "function".
+            hot_lines (typing.Optional[typing.Dict[str,
+                typing.Container[int]]]): if given, the lines that run often
+                in every file. Only calls on these lines are inlined.
+        """
+        self.call_graph = call_graph
+        self.max_size = max_size
+        self.hot_lines = hot_lines
+        self.callees = {}
+        # The number of call sites each function was inlined at.
+        self.inlined = collections.Counter()
+
+    def callee(self, name: str) -> typing.Optional[Callee]:
+        """
+        Args:
+            name (str): the name of a function.
+
+        Returns:
+            typing.Optional[Callee]: the function, if it may be inlined.
+        """
+        if name in self.callees:
+            return self.callees[name]
+        callee = None
+        if name in self.call_graph.functions and \
+                not self.call_graph.callees[name]:
+            file_name, commands = self.call_graph.functions[name]
+            body = commands[1:]
+            accesses = [command for command in body
+                        if command.opcode in (C_PUSH, C_POP)]
+            n_vars = commands[0].arg2
+            if len(body) <= self.max_size and \
+                    stack_depths_balance(body) and \
+                    all(command.arg2 < n_vars for command in accesses
+                        if command.arg1 == "local"):
+                callee = Callee(
+                    file_name, body, n_vars,
+                    max((command.arg2 + 1 for command in accesses
+                         if command.arg1 == "argument"), default=0),
+                    tuple(sorted({command.arg2 for command in accesses
+                                  if command.opcode == C_POP and
+                                  command.arg1 == "pointer"})),
+                    any(command.arg1 == "static" for command in accesses))
+        self.callees[name] = callee
+        return callee
+
+    def inline(self, file_name: str, commands: typing.Iterable[Command]) \
+            -> typing.Iterator[Command]:
+        """
+        Args:
+            file_name (str): the name of the file the commands come from,
+                without its extension.
+            commands (typing.Iterable[Command]): the commands of the file.
+
+        Returns:
+            typing.Iterator[Command]: the commands, with the calls of small
+            leaf functions replaced by their bodies.
+        """
+        function = None
+        for command in commands:
+            if command.opcode == C_FUNCTION:
+                if function is not None:
+                    yield from self.inline_function(file_name, function)
+                function = [command]
+            elif function is not None:
+                function.append(command)
+            else:
+                yield command
+        if function is not None:
+            yield from self.inline_function(file_name, function)
+
+    def inline_function(self, file_name: str,
+                        commands: typing.List[Command]) \
+            -> typing.List[Command]:
+        """
+        Args:
+            file_name (str): the name of the file the function is defined in.
+            commands (typing.List[Command]): the commands of the function,
+                starting with "function".
+
+        Returns:
+            typing.List[Command]: the commands of the function, with the
+            extra locals and the inlined calls.
+        """
+        header = commands[0]
+        base = header.arg2
+        labels = {command.arg1 for command in commands
+                  if command.opcode == C_LABEL}
+        output = []
+        n_extra = 0
+        for command in commands[1:]:
+            callee = None
+            if command.opcode == C_CALL:
+                callee = self.callee(command.arg1)
+            if callee is None or callee.n_args > command.arg2 or \
+                    (callee.uses_statics and callee.file_name != file_name) \
+                    or (self.hot_lines is not None and command.line not in
+                        self.hot_lines.get(file_name, ())):
+                output.append(command)
+                continue
+            site = self.inlined[command.arg1]
+            while any(f"{command.arg1}${site}${label}" in labels
+                      for label in (*callee_labels(callee), "END")):
+                site += 1
+            self.inlined[command.arg1] += 1
+            expansion = self.expand(command, callee, base,
+                                    f"{command.arg1}${site}$")
+            labels.update(expanded.arg1 for expanded in expansion
+                          if expanded.opcode == C_LABEL)
+            output.extend(line_of(expansion, command.line))
+            n_extra = max(n_extra, command.arg2 + callee.n_vars +
+                          len(callee.pointers))
+        return [header._replace(arg2=base + n_extra)] + output
+
+    @staticmethod
+    def expand(call: Command, callee: Callee, base: int, prefix: str) \
+            -> typing.List[Command]:
+        """
+        Args:
+            call (Command): the "call" command.
+            callee (Callee): the called function.
+            base (int): the first local of the caller that the callee may
+                use.
+            prefix (str): the prefix of the callee's labels at this site.
+
+        Returns:
+            typing.List[Command]: the commands that replace the call.
+        """
+        n_args = call.arg2
+        locals_base = base + n_args
+        saves_base = locals_base + callee.n_vars
+        commands = [Command(C_POP, "local", base + index)
+                    for index in reversed(range(n_args))]
+        for index in range(callee.n_vars):
+            commands += [Command(C_PUSH, "constant", 0),
+                         Command(C_POP, "local", locals_base + index)]
+        for slot, pointer in enumerate(callee.pointers):
+            commands += [Command(C_PUSH, "pointer", pointer),
+                         Command(C_POP, "local", saves_base + slot)]
+        restores = []
+        for slot, pointer in enumerate(callee.pointers):
+            restores += [Command(C_PUSH, "local", saves_base + slot),
+                         Command(C_POP, "pointer", pointer)]
+        end = Command(C_LABEL, prefix + "END", 0)
+        for index, command in enumerate(callee.body):
+            opcode = command.opcode
+            if opcode in (C_LABEL, C_GOTO, C_IF):
+                command = command._replace(arg1=prefix + command.arg1)
+            elif opcode in (C_PUSH, C_POP) and command.arg1 == "argument":
+                command = command._replace(arg1="local",
+                                           arg2=base + command.arg2)
+            elif opcode in (C_PUSH, C_POP) and command.arg1 == "local":
+                command = command._replace(arg2=locals_base + command.arg2)
+            elif opcode == C_RETURN:
+                commands += restores
+                if index < len(callee.body) - 1:
+                    commands.append(Command(C_GOTO, end.arg1, 0))
+                continue
+            commands.append(command)
+        if any(command.opcode == C_GOTO and command.arg1 == end.arg1
+               for command in commands):
+            commands.append(end)
+        return commands
+
+
+def callee_labels(callee: Callee) -> typing.Iterator[str]:
+    return (command.arg1 for command in callee.body
+            if command.opcode == C_LABEL)
+
+
+def line_of(commands: typing.Iterable[Command],
+            line: int) -> typing.Iterator[Command]:
+    """Attributes commands to a line, e.g. inlined commands to their call."""
+    return (command._replace(line=line) for command in commands)
@@ -5,92 +5,770 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import argparse
+import collections
+import contextlib
+import io
+import json
+import multiprocessing
+import multiprocessing.pool
 import os
+import shlex
+import signal
+import socket
+import socketserver
+import stat
 import sys
 import typing
-from Parser import Parser
+from Parser import Parser, Command
+from Assembler import Assembler, to_hack, ROM_SIZE
 from CodeWriter import CodeWriter
+from CallGraph import CallGraph, filter_functions
+from Inliner import Inliner
+from PeepholeOptimizer import PeepholeOptimizer, format_report
+from SourceMap import SourceMap
+from SymbolMap import SymbolMap
+from StackCachingCodeWriter import StackCachingCodeWriter
+from TranslationCache import TranslationCache
+from VMInterpreter import Profile
+from VMOptimizer import optimize_commands
+
+
+# The space-saving strategies of -Os, tried in this order until the program
+# fits in the ROM budget. Every level keeps the strategies of the previous
+# ones, and from level 1 on hot lines lose their exemption from the shared
+# routines.
+SPACE_SAVING_LEVELS = [
+    {},
+    {"shared_calls": True, "shared_compares": True},
+    {"loop_locals": True},
+    {"shared_push_pop": True, "stack_caching": False},
+]
+
+
+class RomBudgetError(ValueError):
+    """Raised by -Os when a program doesn't fit in the ROM budget."""
 
 
 def translate_file(input_file: typing.TextIO, output_file: typing.TextIO,
-        bootstrap: bool) -> None:
+        bootstrap: bool, shared_calls: bool = False,
+        shared_compares: bool = False, fast_compares: bool = False,
+        streaming: bool = False, optimize: int = 0,
+        keep_functions: typing.Optional[typing.Collection[str]] = None,
+        source_map: bool = False, stack_caching: bool = False,
+        hot_lines: typing.Optional[typing.Collection[int]] = None,
+        shared_push_pop: bool = False, loop_locals: bool = False,
+        intern_labels: bool = False, symbol_map: bool = False) \
+        -> typing.Counter[str]:
     """Translates a single file.
 
     Args:
         input_file (typing.TextIO): the file to translate.
         output_file (typing.TextIO): writes all output to this file.
+        bootstrap (bool): whether to write the bootstrap code first.
+        shared_calls (bool): use the shared call/return routines instead of
+            inlining the frame handling at every call site.
+        shared_compares (bool): use the shared eq/gt/lt routines instead of
+            inlining the overflow-safe comparison templates.
+        fast_compares (bool): translate comparisons that can't overflow to a
+            plain subtraction.
+        streaming (bool): parse the input lazily, line by line, instead of
+            reading it into memory first.
+        optimize (int): the optimization level. From level 1 on, the parsed
+            commands are simplified by VMOptimizer and the assembly code by
+            a PeepholeOptimizer. Each file gets its own optimizers, so a
+            file's output doesn't depend on other files.
+        keep_functions (typing.Optional[typing.Collection[str]]): if given,
+            only these functions of the file are translated.
+        source_map (bool): precede the code of every command with a source
+            marker, for a SourceMap.
+        stack_caching (bool): keep the top of the stack in D within basic
+            blocks, using a StackCachingCodeWriter.
+        hot_lines (typing.Optional[typing.Collection[int]]): if given, the
+            lines of the file that run often, whose calls, returns and
+            comparisons don't use the shared routines.
+        shared_push_pop (bool): use the shared push/pop routines for local,
+            argument, this and that instead of inlining the address
+            computation at every push and pop.
+        loop_locals (bool): initialize the local variables of functions in
+            a loop instead of one by one.
+        intern_labels (bool): give the generated labels short names.
+        symbol_map (bool): precede every interned label with a symbol
+            marker, for a SymbolMap.
+
+    Returns:
+        typing.Counter[str]: the instructions saved by each peephole rule.
     """
     # Your code goes here!
     # It might be good to start with something like:
     # parser = Parser(input_file)
     # code_writer = CodeWriter(output_file)
-    parser = Parser(input_file)
-    code_writer = CodeWriter(output_file)
+    parser = Parser(input_file, streaming)
     input_filename, input_extension = os.path.splitext(os.path.basename(input_file.name))
-    code_writer.set_file_name(input_filename)
+    commands = parser
+    if keep_functions is not None:
+        commands = filter_functions(parser, frozenset(keep_functions))
+    return translate_commands(commands, output_file, input_filename,
+                              bootstrap, shared_calls=shared_calls,
+                              shared_compares=shared_compares,
+                              fast_compares=fast_compares, optimize=optimize,
+                              source_map=source_map,
+                              stack_caching=stack_caching,
+                              hot_lines=hot_lines,
+                              shared_push_pop=shared_push_pop,
+                              loop_locals=loop_locals,
+                              intern_labels=intern_labels,
+                              symbol_map=symbol_map)
+
+
+def translate_commands(commands: typing.Iterable[Command],
+        output_file: typing.TextIO, file_name: str, bootstrap: bool = False,
+        shared_calls: bool = False, shared_compares: bool = False,
+        fast_compares: bool = False, optimize: int = 0,
+        source_map: bool = False, stack_caching: bool = False,
+        hot_lines: typing.Optional[typing.Collection[int]] = None,
+        shared_push_pop: bool = False, loop_locals: bool = False,
+        intern_labels: bool = False, symbol_map: bool = False) \
+        -> typing.Counter[str]:
+    """Translates parsed commands.
+
+    Args:
+        commands (typing.Iterable[Command]): the commands to translate.
+        output_file (typing.TextIO): writes all output to this file.
+        file_name (str): the name of the .vm file the commands come from,
+            without its extension.
+        bootstrap, shared_calls, shared_compares, fast_compares, optimize,
+        source_map, stack_caching, hot_lines, shared_push_pop, loop_locals,
+        intern_labels, symbol_map: as in translate_file.
+
+    Returns:
+        typing.Counter[str]: the instructions saved by each peephole rule.
+    """
+    if optimize:
+        commands = optimize_commands(commands)
+        output_file = PeepholeOptimizer(output_file, optimize)
+    code_writer_class = StackCachingCodeWriter if stack_caching \
+        else CodeWriter
+    code_writer = code_writer_class(output_file, shared_calls=shared_calls,
+                                    shared_compares=shared_compares,
+                                    fast_compares=fast_compares,
+                                    source_map=source_map,
+                                    hot_lines=None if hot_lines is None
+                                    else frozenset(hot_lines),
+                                    shared_push_pop=shared_push_pop,
+                                    loop_locals=loop_locals,
+                                    intern_labels=intern_labels,
+                                    symbol_map=symbol_map)
+    code_writer.set_file_name(file_name)
 
     if bootstrap:
         code_writer.bootstrap()
 
-    while parser.has_more_commands():
-        command = parser.command_type()
-
-        if command == "C_POP" or \
-                parser.command_type() == "C_PUSH":
-            segment = parser.arg1()
-            n_vars = parser.arg2()
-            code_writer.write_push_pop(command, segment, n_vars)
-        elif command == "C_ARITHMETIC":
-            segment = parser.arg1()
-            code_writer.write_arithmetic(segment)
-        elif command == "C_LABEL":
-            segment = parser.arg1()
-            code_writer.write_label(segment)
-        elif command == "C_GOTO":
-            segment = parser.arg1()
-            code_writer.write_goto(segment)
-        elif command == "C_IF":
-            segment = parser.arg1()
-            code_writer.write_if(segment)
-        elif command == "C_FUNCTION":
-            segment = parser.arg1()
-            n_vars = parser.arg2()
-            code_writer.write_function(segment, int(n_vars))
-        elif command == "C_CALL":
-            segment = parser.arg1()
-            n_vars = parser.arg2()
-            code_writer.write_call(segment, int(n_vars))
-        elif command == "C_RETURN":
-            code_writer.write_return()
-
-        parser.advance()
+    code_writer.write_commands(commands)
+    code_writer.flush()
 
+    if optimize:
+        output_file.flush()
+        return output_file.saved
+    return collections.Counter()
 
-if "__main__" == __name__:
-    # Parses the input path and calls translate_file on each input file.
-    # This opens both the input and the output files!
-    # Both are closed automatically when the code finishes running.
-    # If the output file does not exist, it is created automatically in the
-    # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: VMtranslator <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+
+def count_instructions(assembly: str) -> int:
+    """
+    Args:
+        assembly (str): Hack assembly code.
+
+    Returns:
+        int: the number of instructions in the code, i.e. its size in ROM.
+    """
+    return sum(1 for line in assembly.splitlines()
+               if line and not line.startswith(("(", "//")))
+
+
+def write_bootstrap(output_file: typing.TextIO, shared_calls: bool = False,
+        shared_compares: bool = False, fast_compares: bool = False,
+        optimize: int = 0, shared_push_pop: bool = False,
+        intern_labels: bool = False, symbol_map: bool = False, **options) \
+        -> typing.Counter[str]:
+    """Writes the bootstrap code on its own, so that the translation of every
+    file is independent of the order in which the files are translated.
+
+    Args:
+        output_file (typing.TextIO): writes all output to this file.
+        shared_calls, shared_compares, fast_compares, optimize,
+            shared_push_pop, intern_labels, symbol_map: as in translate_file.
+        options: the other keyword arguments of translate_file, which don't
+            affect the bootstrap code.
+
+    Returns:
+        typing.Counter[str]: the instructions saved by each peephole rule.
+    """
+    if optimize:
+        output_file = PeepholeOptimizer(output_file, optimize)
+    code_writer = CodeWriter(output_file, shared_calls=shared_calls,
+                             shared_compares=shared_compares,
+                             fast_compares=fast_compares,
+                             shared_push_pop=shared_push_pop,
+                             intern_labels=intern_labels,
+                             symbol_map=symbol_map)
+    code_writer.bootstrap()
+    code_writer.flush()
+    if optimize:
+        output_file.flush()
+        return output_file.saved
+    return collections.Counter()
+
+
+def translate_to_string(job: typing.Tuple[str, typing.Dict]) \
+        -> typing.Tuple[str, typing.Counter[str]]:
+    """Translates a single file, without the bootstrap code, into a string.
+    Used for caching translations and by worker processes.
+
+    Args:
+        job (typing.Tuple[str, typing.Dict]): the path of the file to
+            translate and the keyword arguments of translate_file.
+
+    Returns:
+        typing.Tuple[str, typing.Counter[str]]: the assembly code, and the
+        instructions saved by each peephole rule.
+    """
+    input_path, options = job
+    output = io.StringIO()
+    with open(input_path, 'r') as input_file:
+        saved = translate_file(input_file, output, False, **options)
+    return output.getvalue(), saved
+
+
+def write_program(output: typing.TextIO, options: typing.Dict,
+        files_to_translate: typing.List[str], file_names: typing.List[str],
+        file_options: typing.List[typing.Dict],
+        file_commands: typing.Optional[typing.List[typing.List[Command]]],
+        cache: typing.Optional[TranslationCache], processes: int) \
+        -> typing.Counter[str]:
+    """Writes the bootstrap code and the translation of every file.
+
+    Args:
+        output (typing.TextIO): writes all output to this stream.
+        options (typing.Dict): the keyword arguments of translate_file that
+            all files share.
+        files_to_translate (typing.List[str]): the paths of the files.
+        file_names (typing.List[str]): the names of the files, without their
+            extension.
+        file_options (typing.List[typing.Dict]): the keyword arguments of
+            translate_file of every file.
+        file_commands (typing.Optional[typing.List[typing.List[Command]]]):
+            if given, the parsed (and inlined) commands of every file, which
+            are translated instead of the files.
+        cache (typing.Optional[TranslationCache]): the translation cache.
+        processes (int): the number of parallel processes. The files are
+            translated serially when streaming, since a worker process
+            returns the whole translation of a file.
+
+    Returns:
+        typing.Counter[str]: the instructions saved by each peephole rule.
+    """
+    saved = collections.Counter()
+    # The options of translate_commands, for commands that are already
+    # parsed.
+    translation_options = dict(options)
+    del translation_options["streaming"]
+    saved.update(write_bootstrap(output, **options))
+    if file_commands is not None:
+        for file_name, commands, input_options in zip(
+                file_names, file_commands, file_options):
+            if "keep_functions" in input_options:
+                commands = filter_functions(
+                    commands, frozenset(input_options["keep_functions"]))
+            saved.update(translate_commands(
+                commands, output, file_name, **translation_options,
+                hot_lines=input_options.get("hot_lines")))
+    elif cache is None and (processes == 1 or options["streaming"]):
+        # Every file is written straight to the output, so memory use
+        # doesn't grow with the size of the files.
+        for input_path, input_options in zip(files_to_translate,
+                                             file_options):
+            with open(input_path, 'r') as input_file:
+                saved.update(translate_file(input_file, output,
+                                            False, **input_options))
+    else:
+        keys = [cache.key(input_path, input_options) if cache else None
+                for input_path, input_options
+                in zip(files_to_translate, file_options)]
+        entries = [cache.get(key) if cache else None for key in keys]
+        jobs = [(input_path, input_options)
+                for input_path, input_options, entry
+                in zip(files_to_translate, file_options, entries)
+                if entry is None]
+        # Every file is translated by its own CodeWriter into its own
+        # buffer, and both map and imap return the buffers in the order
+        # of the files, so the output is identical to the serial
+        # translation.
+        if processes > 1 and jobs:
+            translations = worker_pool(processes).imap(
+                translate_to_string, jobs)
+        else:
+            translations = map(translate_to_string, jobs)
+        for key, entry in zip(keys, entries):
+            if entry is None:
+                entry = next(translations)
+                if cache:
+                    cache.put(key, *entry)
+            fragment, fragment_saved = entry
+            output.write(fragment)
+            saved.update(fragment_saved)
+    return saved
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """
+    Returns:
+        argparse.ArgumentParser: the parser of the command line arguments,
+        which are also the arguments of every job in server mode.
+    """
+    arg_parser = argparse.ArgumentParser(prog="VMtranslator")
+    arg_parser.add_argument(
+        "input_paths", nargs="*", metavar="input_path",
+        help="a .vm file or a directory of .vm files. Several paths are "
+             "translated one after the other by the same process")
+    arg_parser.add_argument(
+        "--shared-calls", action="store_true",
+        help="jump into shared call/return routines instead of inlining "
+             "the frame handling at every call site")
+    arg_parser.add_argument(
+        "--shared-compares", action="store_true",
+        help="jump into shared eq/gt/lt routines instead of inlining the "
+             "overflow-safe comparison templates")
+    arg_parser.add_argument(
+        "--shared-push-pop", action="store_true",
+        help="jump into shared push/pop routines for local, argument, this "
+             "and that instead of inlining the address computation")
+    arg_parser.add_argument(
+        "--loop-locals", action="store_true",
+        help="initialize the local variables of functions in a loop instead "
+             "of one by one")
+    arg_parser.add_argument(
+        "--fast-compares", action="store_true",
+        help="use a plain subtraction for comparisons that can't overflow")
+    arg_parser.add_argument(
+        "--stream", action="store_true",
+        help="parse the input files lazily, keeping memory use flat "
+             "(translates the files one by one, without the cache)")
+    arg_parser.add_argument(
+        "-O", dest="optimize", type=int, choices=(0, 1, 2), default=0,
+        help="optimization level: 1 and 2 fold constant expressions and "
+             "run the peephole optimizer on the emitted assembly")
+    arg_parser.add_argument(
+        "-Os", dest="optimize_size", action="store_true",
+        help="optimize at level 2 and make sure the program fits in the "
+             "ROM: if it doesn't, switch to the space-saving strategies one "
+             "by one, and fail with a size breakdown if it still doesn't")
+    arg_parser.add_argument(
+        "--rom-budget", type=int, metavar="INSTRUCTIONS",
+        help=f"the ROM budget of -Os (default: {ROM_SIZE}). Implies -Os")
+    arg_parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="report optimization statistics to stderr")
+    arg_parser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="translate the files in this many parallel processes")
+    arg_parser.add_argument(
+        "--no-cache", action="store_true",
+        help="translate every file instead of reusing cached translations "
+             "of unchanged files")
+    arg_parser.add_argument(
+        "--cache-dir",
+        help="the directory of the translation cache (default: .vmcache "
+             "next to the output file)")
+    arg_parser.add_argument(
+        "--cache-size", type=int, default=64,
+        help="evict cached translations beyond this many megabytes")
+    arg_parser.add_argument(
+        "--emit", choices=("asm", "hack"), default="asm",
+        help="write Hack assembly code, or assemble it and write the binary "
+             "machine code")
+    arg_parser.add_argument(
+        "--whole-program", action="store_true",
+        help="only translate the functions reachable from Sys.init")
+    arg_parser.add_argument(
+        "--source-map", action="store_true",
+        help="write a .map file with the ROM addresses of the code of every "
+             "VM command")
+    arg_parser.add_argument(
+        "--size-report", action="store_true",
+        help="report the code size per command type, segment, function and "
+             "file to stderr")
+    arg_parser.add_argument(
+        "--intern-labels", action="store_true",
+        help="give the labels of comparisons, return addresses and local "
+             "initialization loops short generated names")
+    arg_parser.add_argument(
+        "--symbol-map", action="store_true",
+        help="write a .sym file with the original name of every interned "
+             "label. Implies --intern-labels")
+    arg_parser.add_argument(
+        "--stack-caching", action="store_true",
+        help="keep the value on top of the stack in D within basic blocks "
+             "instead of storing every push in RAM")
+    arg_parser.add_argument(
+        "--inline", type=int, default=0, metavar="MAX_COMMANDS",
+        help="substitute leaf functions of at most this many commands at "
+             "their call sites (translates all files together, without the "
+             "cache)")
+    arg_parser.add_argument(
+        "--profile",
+        help="a profile written by VMInterpreter.py: only inline the calls "
+             "on hot lines, and keep the calls, returns and comparisons of "
+             "hot lines out of the shared routines")
+    arg_parser.add_argument(
+        "--serve", action="store_true",
+        help="translate jobs read from stdin, one per line, and answer each "
+             "with a line of JSON on stdout")
+    arg_parser.add_argument(
+        "--socket", metavar="PATH",
+        help="translate jobs sent over connections to this Unix socket")
+    return arg_parser
+
+
+def translate_program(program_path: str, args: argparse.Namespace) -> str:
+    """Translates a .vm file, or all .vm files in a directory, into a single
+    output file next to them. Reports go to sys.stderr.
+
+    Args:
+        program_path (str): the .vm file or the directory.
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        str: the path of the output file.
+    """
+    argument_path = os.path.abspath(program_path)
     if os.path.isdir(argument_path):
         files_to_translate = [
             os.path.join(argument_path, filename)
-            for filename in os.listdir(argument_path)]
+            for filename in sorted(os.listdir(argument_path))]
         output_path = os.path.join(argument_path, os.path.basename(
             argument_path))
     else:
         files_to_translate = [argument_path]
         output_path, extension = os.path.splitext(argument_path)
-    output_path += ".asm"
-    bootstrap = True
-    with open(output_path, 'w') as output_file:
-        for input_path in files_to_translate:
-            filename, extension = os.path.splitext(input_path)
-            if extension.lower() != ".vm":
-                continue
+    output_path += "." + args.emit
+    options = {"shared_calls": args.shared_calls,
+               "shared_compares": args.shared_compares,
+               "fast_compares": args.fast_compares,
+               "streaming": args.stream,
+               "optimize": args.optimize,
+               "source_map": args.source_map or args.size_report,
+               "stack_caching": args.stack_caching,
+               "shared_push_pop": args.shared_push_pop,
+               "loop_locals": args.loop_locals,
+               "intern_labels": args.intern_labels or args.symbol_map,
+               "symbol_map": args.symbol_map}
+    budget = None
+    if args.optimize_size or args.rom_budget is not None:
+        budget = ROM_SIZE if args.rom_budget is None else args.rom_budget
+        # The size is measured by a SourceMap, which also gives the
+        # breakdown.
+        options.update(optimize=2, source_map=True)
+    files_to_translate = [
+        input_path for input_path in files_to_translate
+        if os.path.splitext(input_path)[1].lower() == ".vm"]
+    file_options = [options] * len(files_to_translate)
+    file_names = [os.path.splitext(os.path.basename(input_path))[0]
+                  for input_path in files_to_translate]
+    hot_lines = None
+    if args.profile:
+        profile = Profile.load(args.profile)
+        hot_lines = {file_name: profile.hot_lines(file_name)
+                     for file_name in file_names}
+        file_options = [
+            dict(options, hot_lines=tuple(sorted(hot_lines[file_name])))
+            for file_name in file_names]
+    # The options of translate_commands, for commands that are already
+    # parsed.
+    translation_options = dict(options)
+    del translation_options["streaming"]
+    dropped = []
+    # With --inline, the inlined commands of every file.
+    file_commands = None
+    if args.whole_program or args.inline:
+        call_graph = CallGraph()
+        for input_path, file_name in zip(files_to_translate, file_names):
+            with open(input_path, 'r') as input_file:
+                call_graph.add_file(file_name, Parser(input_file, args.stream))
+    if args.inline:
+        inliner = Inliner(call_graph, args.inline, hot_lines)
+        file_commands = []
+        for input_path, file_name in zip(files_to_translate, file_names):
             with open(input_path, 'r') as input_file:
-                translate_file(input_file, output_file, bootstrap)
-            bootstrap = False
+                file_commands.append(list(inliner.inline(
+                    file_name, Parser(input_file, args.stream))))
+        # Inlining may leave functions without callers.
+        call_graph = CallGraph()
+        for file_name, commands in zip(file_names, file_commands):
+            call_graph.add_file(file_name, commands)
+    if args.whole_program:
+        reachable = call_graph.reachable()
+        # Without an entry point nothing is known to be unreachable.
+        if reachable:
+            file_options = [
+                dict(input_options, keep_functions=tuple(sorted(
+                    name for name in call_graph.file_functions(file_name)
+                    if name in reachable)))
+                for file_name, input_options in zip(file_names, file_options)]
+            dropped = [name for name in call_graph.functions
+                       if name not in reachable]
+    # A cache entry holds the whole translation of a file, so streaming
+    # doesn't use the cache.
+    cache = None
+    if not args.no_cache and not args.stream:
+        cache = TranslationCache(
+            args.cache_dir or os.path.join(os.path.dirname(output_path),
+                                           ".vmcache"),
+            args.cache_size * 1024 * 1024)
+    # With --emit hack, the code is assembled in memory as it is written.
+    assembler = Assembler() if args.emit == "hack" else None
+    source_map = symbol_map = None
+    if budget is None:
+        with open(output_path, 'w') as output_file:
+            output = assembler or output_file
+            if options["source_map"]:
+                output = source_map = SourceMap(output)
+            if args.symbol_map:
+                output = symbol_map = SymbolMap(output)
+            saved = write_program(output, options, files_to_translate,
+                                  file_names, file_options, file_commands,
+                                  cache, args.jobs)
+            if symbol_map:
+                symbol_map.flush()
+            if source_map:
+                source_map.flush()
+            if assembler:
+                output_file.write(to_hack(assembler.resolve()))
+    else:
+        level_options = options
+        # The SourceMap of the smallest translation so far, which the
+        # breakdown of a failure is about.
+        smallest = None
+        for level, overrides in enumerate(SPACE_SAVING_LEVELS):
+            if level and all(level_options[key] == value
+                             for key, value in overrides.items()):
+                # The strategies of this level are already in use.
+                continue
+            level_options = dict(level_options, **overrides)
+            if level:
+                file_options = [
+                    dict({key: value for key, value in input_options.items()
+                          if key != "hot_lines"}, **level_options)
+                    for input_options in file_options]
+            code = io.StringIO()
+            output = source_map = SourceMap(code)
+            if args.symbol_map:
+                output = symbol_map = SymbolMap(output)
+            saved = write_program(output, level_options, files_to_translate,
+                                  file_names, file_options, file_commands,
+                                  cache, args.jobs)
+            if symbol_map:
+                symbol_map.flush()
+            source_map.flush()
+            if source_map.address <= budget:
+                break
+            if smallest is None or source_map.address < smallest.address:
+                smallest = source_map
+        else:
+            print(smallest.report(), file=sys.stderr)
+            raise RomBudgetError(
+                f"{output_path} needs at least {smallest.address} "
+                f"instructions, {smallest.address - budget} more than the ROM "
+                f"budget of {budget}, even with the space-saving strategies")
+        options = level_options
+        translation_options = dict(options)
+        del translation_options["streaming"]
+        strategies = [name for name in (
+            "shared_calls", "shared_compares", "loop_locals",
+            "shared_push_pop") if options[name]]
+        print(f"rom budget: {source_map.address} of {budget} instructions"
+              f" ({', '.join(strategies) or 'no space-saving strategies'})",
+              file=sys.stderr)
+        if args.verbose and not args.size_report:
+            print(source_map.report(), file=sys.stderr)
+        with open(output_path, 'w') as output_file:
+            if assembler:
+                assembler.write(code.getvalue())
+                output_file.write(to_hack(assembler.resolve()))
+            else:
+                output_file.write(code.getvalue())
+    if args.source_map:
+        with open(os.path.splitext(output_path)[0] + ".map", 'w') as map_file:
+            source_map.write_map(map_file)
+    if args.symbol_map:
+        with open(os.path.splitext(output_path)[0] + ".sym", 'w') as map_file:
+            symbol_map.write_map(map_file)
+    if args.size_report:
+        print(source_map.report(), file=sys.stderr)
+    if cache:
+        cache.evict()
+    if args.whole_program:
+        # The size of a dropped function is the size of its translation on
+        # its own, with the same options.
+        dropped_sizes = []
+        for name in dropped:
+            file_name, commands = call_graph.functions[name]
+            assembly = io.StringIO()
+            translate_commands(commands, assembly, file_name,
+                               **translation_options)
+            dropped_sizes.append(count_instructions(assembly.getvalue()))
+        print(f"whole-program: dropped {len(dropped)} unreachable functions, "
+              f"{sum(dropped_sizes)} instructions saved", file=sys.stderr)
+        if args.verbose:
+            for name, size in zip(dropped, dropped_sizes):
+                print(f"  {name}: {size} instructions", file=sys.stderr)
+    if args.inline:
+        print(f"inline: inlined {sum(inliner.inlined.values())} calls of "
+              f"{len(inliner.inlined)} functions", file=sys.stderr)
+        if args.verbose:
+            for name, count in inliner.inlined.most_common():
+                print(f"  {name}: {count} calls", file=sys.stderr)
+    if args.verbose:
+        if args.optimize:
+            print(format_report(saved), file=sys.stderr)
+        if cache:
+            print(f"cache: {cache.hits} hits, {cache.misses} misses",
+                  file=sys.stderr)
+    return output_path
+
+
+def worker_pool(jobs: int) -> multiprocessing.pool.Pool:
+    """
+    Args:
+        jobs (int): the number of worker processes.
+
+    Returns:
+        multiprocessing.pool.Pool: a pool of that many workers. Pools are
+        kept until close_pools is called, so that the programs of a batch or
+        a server reuse the same workers.
+    """
+    if jobs not in worker_pools:
+        worker_pools[jobs] = multiprocessing.Pool(jobs)
+    return worker_pools[jobs]
+
+
+def close_pools() -> None:
+    for pool in worker_pools.values():
+        pool.close()
+        pool.join()
+    worker_pools.clear()
+
+
+def run_job(line: str) -> typing.Optional[str]:
+    """Runs a job of server mode.
+
+    Args:
+        line (str): the command line arguments of the job, either as a JSON
+            array of strings or as a shell command line.
+
+    Returns:
+        typing.Optional[str]: the answer to the job, a line of JSON with its
+        "status" ("ok" or "error"), its "outputs" or "error", and the "log"
+        that a standalone run would have written to stderr. None for an
+        empty line.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    log = io.StringIO()
+    response = {"status": "ok"}
+    try:
+        with contextlib.redirect_stderr(log):
+            arg_parser = build_arg_parser()
+            arguments = json.loads(line) if line.startswith("[") \
+                else shlex.split(line)
+            args = arg_parser.parse_args(arguments)
+            if args.serve or args.socket:
+                arg_parser.error("jobs can't start a server")
+            if not args.input_paths:
+                arg_parser.error("the job has no input path")
+            response["outputs"] = [translate_program(input_path, args)
+                                   for input_path in args.input_paths]
+    except SystemExit:
+        # Raised by argparse, which explains the error in the log.
+        response = {"status": "error", "error": "invalid arguments"}
+    except Exception as error:
+        response = {"status": "error",
+                    "error": f"{type(error).__name__}: {error}"}
+    response["log"] = log.getvalue()
+    return json.dumps(response) + "\n"
+
+
+def serve(input_stream: typing.TextIO, output_stream: typing.TextIO) -> None:
+    """Runs the jobs read from input_stream, one per line, and writes the
+    answer to each one to output_stream as soon as it is done.
+    """
+    for line in input_stream:
+        response = run_job(line)
+        if response is not None:
+            output_stream.write(response)
+            output_stream.flush()
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Serves the jobs of a single connection to the Unix socket."""
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            response = run_job(line.decode())
+            if response is not None:
+                self.wfile.write(response.encode())
+                self.wfile.flush()
+
+
+def serve_socket(path: str) -> None:
+    """Serves jobs on a Unix socket, one connection at a time, until
+    interrupted or terminated.
+
+    Args:
+        path (str): the path of the socket. A stale socket is replaced.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise SystemExit("Unix sockets aren't supported on this platform")
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.remove(path)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        with socketserver.UnixStreamServer(path, JobHandler) as server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Worker pools by size, see worker_pool.
+worker_pools = {}
+
+
+if "__main__" == __name__:
+    # Parses the input paths and calls translate_file on each input file.
+    # This opens both the input and the output files!
+    # Both are closed automatically when the code finishes running.
+    # If the output file does not exist, it is created automatically in the
+    # correct path, using the correct filename.
+    # In batch and server mode, a single process translates many programs,
+    # so the modules are imported (and the translator's version hashed)
+    # only once.
+    arg_parser = build_arg_parser()
+    args = arg_parser.parse_args()
+    try:
+        if args.serve:
+            serve(sys.stdin, sys.stdout)
+        elif args.socket:
+            serve_socket(args.socket)
+        elif not args.input_paths:
+            arg_parser.error("the following arguments are required: "
+                             "input_path")
+        else:
+            for input_path in args.input_paths:
+                translate_program(input_path, args)
+    except RomBudgetError as error:
+        arg_parser.exit(1, f"{arg_parser.prog}: error: {error}\n")
+    finally:
+        close_pools()
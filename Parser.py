@@ -5,9 +5,43 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import itertools
 import typing
 
 
+# The opcodes of parsed commands, and the command types they stand for.
+# The last ones are never parsed, they are only produced by VMOptimizer:
+# - C_ARITHMETIC_CONSTANT: the binary arithmetic command arg1 with the
+#   constant arg2 as its second operand.
+# - C_IF_COMPARISON: pops two values and jumps to the label arg1 if the
+#   condition CONDITIONS[arg2] holds between them, i.e. a comparison (or a
+#   comparison and "not") followed by "if-goto".
+# - C_IF_NOT: "not" followed by "if-goto arg1".
+C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_RETURN, \
+    C_CALL, C_ARITHMETIC_CONSTANT, C_IF_COMPARISON, C_IF_NOT = range(12)
+COMMAND_TYPES = ("C_ARITHMETIC", "C_PUSH", "C_POP", "C_LABEL", "C_GOTO",
+                 "C_IF", "C_FUNCTION", "C_RETURN", "C_CALL",
+                 "C_ARITHMETIC_CONSTANT", "C_IF_COMPARISON", "C_IF_NOT")
+# The conditions of C_IF_COMPARISON: the comparisons, then their negations.
+CONDITIONS = ("eq", "gt", "lt", "ne", "le", "ge")
+OPCODES = {"push": C_PUSH, "pop": C_POP, "label": C_LABEL, "goto": C_GOTO,
+           "if-goto": C_IF, "function": C_FUNCTION, "return": C_RETURN,
+           "call": C_CALL}
+
+
+class Command(typing.NamedTuple):
+    """A tokenized VM command."""
+    # One of the C_* opcodes.
+    opcode: int
+    # The first argument, or the command itself for arithmetic commands.
+    arg1: str
+    # The second argument of push, pop, function and call, otherwise 0.
+    arg2: int
+    # The number of the line the command is on, counting from 1, or 0 if the
+    # command wasn't parsed.
+    line: int = 0
+
+
 class Parser:
     """
     # Parser
@@ -16,6 +50,8 @@ class Parser:
     input code. It reads VM commands, parses them, and provides convenient
     access to their components.
     In addition, it removes all white space and comments.
+    Every line is tokenized exactly once into a Command; iterating over the
+    parser yields these commands.
 
     ## VM Language Specification
 
@@ -46,29 +82,81 @@ class Parser:
       - return
     """
 
-    def __init__(self, input_file: typing.TextIO) -> None:
+    def __init__(self, input_file: typing.TextIO,
+                 streaming: bool = False) -> None:
         """Gets ready to parse the input file.
 
         Args:
             input_file (typing.TextIO): input file.
+            streaming (bool): if True, the input is read and tokenized lazily,
+                line by line, as the commands are consumed, so memory use
+                doesn't grow with the size of the input. Otherwise the whole
+                input is tokenized up front and kept in self.commands.
+        """
+        if streaming:
+            self.commands = None
+            self.remaining = self.parse_lines(input_file)
+        else:
+            self.commands = list(
+                self.parse_lines(input_file.read().splitlines()))
+            self.remaining = iter(self.commands)
+        self.current = next(self.remaining, None)
+
+    @classmethod
+    def parse_lines(cls, lines: typing.Iterable[str]) \
+            -> typing.Iterator[Command]:
+        """Tokenizes lines of VM code, skipping white space and comments.
+
+        Args:
+            lines (typing.Iterable[str]): lines of VM code.
+
+        Returns:
+            typing.Iterator[Command]: the commands on the lines.
         """
-        self.index = 0
-        self.input_instructions = input_file.read().splitlines()
-        self.clean_instructions = \
-            self.remove_white_spaces(self.input_instructions)
-        self.length = len(self.clean_instructions)
-
-    def remove_white_spaces(self, input_instructions: typing.List[str]) \
-            -> typing.List[str]:
-        clean_instructions = []
-        for line in input_instructions:
-            comment_index = line.find('//')
-            if comment_index != -1:
-                line = line[:comment_index]
-            # line = line.replace(" ", "")
-            if line:
-                clean_instructions.append(line)
-        return clean_instructions
+        for number, line in enumerate(lines, 1):
+            command = cls.parse_line(line, number)
+            if command is not None:
+                yield command
+
+    @staticmethod
+    def parse_line(line: str, number: int = 0) -> typing.Optional[Command]:
+        """Tokenizes a single line of VM code.
+
+        Args:
+            line (str): a line of VM code.
+            number (int): the number of the line.
+
+        Returns:
+            typing.Optional[Command]: the command on the line, or None if the
+            line only holds white space and comments.
+        """
+        comment_index = line.find('//')
+        if comment_index != -1:
+            line = line[:comment_index]
+        words = line.split()
+        if not words:
+            return None
+        opcode = OPCODES.get(words[0], C_ARITHMETIC)
+        if opcode == C_ARITHMETIC:
+            return Command(opcode, words[0], 0, number)
+        elif opcode == C_RETURN:
+            return Command(opcode, "", 0, number)
+        elif opcode == C_PUSH or opcode == C_POP or \
+                opcode == C_FUNCTION or opcode == C_CALL:
+            return Command(opcode, words[1], int(words[2]), number)
+        return Command(opcode, words[1], 0, number)
+
+    def __iter__(self) -> typing.Iterator[Command]:
+        """Consumes the parser.
+
+        Returns:
+            typing.Iterator[Command]: the commands of the input, starting
+            from the current one.
+        """
+        if self.current is None:
+            return iter(())
+        current, self.current = self.current, None
+        return itertools.chain((current,), self.remaining)
 
     def has_more_commands(self) -> bool:
         """Are there more commands in the input?
@@ -76,7 +164,7 @@ class Parser:
         Returns:
             bool: True if there are more commands, False otherwise.
         """
-        return self.length > self.index
+        return self.current is not None
 
     def advance(self) -> None:
         """Reads the next command from the input and makes it the current
@@ -84,7 +172,7 @@ class Parser:
         there is no current command.
         """
         if self.has_more_commands():
-            self.index += 1
+            self.current = next(self.remaining, None)
 
     def command_type(self) -> str:
         """
@@ -95,25 +183,7 @@ class Parser:
             "C_PUSH", "C_POP", "C_LABEL", "C_GOTO", "C_IF", "C_FUNCTION",
             "C_RETURN", "C_CALL".
         """
-        line = self.clean_instructions[self.index]
-        if line.startswith("push"):
-            return "C_PUSH"
-        elif line.startswith("pop"):
-            return "C_POP"
-        elif line.startswith("label"):
-            return "C_LABEL"
-        elif line.startswith("goto"):
-            return "C_GOTO"
-        elif line.startswith("if-goto"):
-            return "C_IF"
-        elif line.startswith("function"):
-            return "C_FUNCTION"
-        elif line.startswith("return"):
-            return "C_RETURN"
-        elif line.startswith("call"):
-            return "C_CALL"
-        else:
-            return "C_ARITHMETIC"
+        return COMMAND_TYPES[self.current.opcode]
 
     def arg1(self) -> str:
         """
@@ -122,13 +192,7 @@ class Parser:
             "C_ARITHMETIC", the command itself (add, sub, etc.) is returned.
             Should not be called if the current command is "C_RETURN".
         """
-        if self.command_type() != "C_RETURN":
-            line = self.clean_instructions[self.index]
-            args = line.split()
-            com_type = self.command_type()
-            if com_type == "C_ARITHMETIC":
-                return args[0]
-            return args[1]
+        return self.current.arg1
 
     def arg2(self) -> int:
         """
@@ -137,9 +201,4 @@ class Parser:
             called only if the current command is "C_PUSH", "C_POP",
             "C_FUNCTION" or "C_CALL".
         """
-        line = self.clean_instructions[self.index]
-        args = line.split()
-        com_type = self.command_type()
-        if com_type == "C_PUSH" or com_type == "C_POP" or \
-                com_type == "C_FUNCTION" or com_type == "C_CALL":
-            return args[2]
+        return self.current.arg2
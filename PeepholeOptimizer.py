@@ -0,0 +1,356 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import typing
+
+
+# A rule gets the already optimized instructions, the pending instructions
+# and the index of the current pending instruction. If it matches, it returns
+# how many pending instructions it consumed and what to write instead.
+Match = typing.Optional[typing.Tuple[int, typing.List[str]]]
+Rule = typing.Callable[[typing.List[str], typing.List[str], int], Match]
+
+# The end of every push template: stores D on top of the stack.
+PUSH_TAIL = ["@SP", "A=M", "M=D", "@SP", "M=M+1"]
+
+# How many instructions a rule may scan backwards or forwards.
+LOOKBACK = 8
+LOOKAHEAD = 32
+
+# The number of buffered instructions after which a window is optimized.
+WINDOW_SIZE = 4096
+
+# At -O2 the rules are reapplied until nothing changes, at most this often.
+MAX_PASSES = 4
+
+
+def is_label(line: str) -> bool:
+    return line.startswith("(")
+
+
+def is_address(line: str) -> bool:
+    return line.startswith("@")
+
+
+def is_comment(line: str) -> bool:
+    return line.startswith("//")
+
+
+def dest(line: str) -> str:
+    """
+    Args:
+        line (str): a C-instruction.
+
+    Returns:
+        str: the registers the instruction writes to, e.g. "AM".
+    """
+    if "=" in line:
+        return line.split("=", 1)[0]
+    return ""
+
+
+def comp(line: str) -> str:
+    """
+    Args:
+        line (str): a C-instruction.
+
+    Returns:
+        str: the computation of the instruction, e.g. "D+M".
+    """
+    return line.split("=", 1)[-1].split(";", 1)[0]
+
+
+def has_jump(line: str) -> bool:
+    return ";" in line
+
+
+def is_neutral(line: str) -> bool:
+    """
+    Args:
+        line (str): an instruction.
+
+    Returns:
+        bool: True if the instruction neither touches SP nor writes to an
+        address that was computed at runtime, so it can't touch the stack.
+    """
+    if is_address(line):
+        return line != "@SP"
+    return not is_label(line) and not has_jump(line) and "A" not in dest(line)
+
+
+def follows_address(lines: typing.List[str], i: int) -> bool:
+    """
+    Returns:
+        bool: True if the instruction at lines[i] doesn't depend on the value
+        of A, i.e. it loads A itself, is a label or lines ends before it.
+    """
+    return i >= len(lines) or is_address(lines[i]) or is_label(lines[i])
+
+
+def fuse_push_pop(output: typing.List[str], lines: typing.List[str],
+                  i: int) -> Match:
+    """Cancels a push against the pop that directly follows it: the value
+    stays in D (or on top of the stack) and SP is neither incremented nor
+    decremented.
+    """
+    if lines[i:i + 5] != PUSH_TAIL:
+        return None
+    j = i + 5
+    if lines[j:j + 3] == ["@SP", "AM=M-1", "D=M"]:
+        if follows_address(lines, j + 3):
+            return 8, []
+        return 8, PUSH_TAIL[:3]
+    k = j
+    while k < len(lines) and k - j < LOOKAHEAD and lines[k] != "@SP":
+        if not is_neutral(lines[k]):
+            return None
+        k += 1
+    if lines[k:k + 3] != ["@SP", "A=M-1", "D=M"]:
+        return None
+    m = k + 3
+    while m < len(lines) and m - k < LOOKAHEAD and lines[m] != "@SP":
+        if is_label(lines[m]) or has_jump(lines[m]):
+            return None
+        m += 1
+    if lines[m:m + 2] != ["@SP", "M=M-1"] or not follows_address(lines, m + 2):
+        return None
+    before, after = lines[j:k], lines[k + 3:m]
+    if not before and after[:1] == ["A=A-1"]:
+        # A binary operation: the value is already in D and the other
+        # operand is on top of the stack.
+        replacement = ["@SP", "A=M-1"] + after[1:]
+    elif before:
+        replacement = PUSH_TAIL[:3] + before + ["@SP", "A=M", "D=M"] + after
+    elif after and is_address(after[0]):
+        replacement = after
+    else:
+        replacement = PUSH_TAIL[:3] + after
+    return m + 2 - i, replacement
+
+
+def fuse_stack_increment(output: typing.List[str], lines: typing.List[str],
+                         i: int) -> Match:
+    """Replaces an increment of SP that is immediately undone by a pop."""
+    if lines[i:i + 4] == ["@SP", "M=M+1", "@SP", "AM=M-1"]:
+        return 4, ["@SP", "A=M"]
+    return None
+
+
+def remove_redundant_address(output: typing.List[str], lines: typing.List[str],
+                             i: int) -> Match:
+    """Drops "@X" if A already holds X."""
+    line = lines[i]
+    if not is_address(line):
+        return None
+    for previous in reversed(output[-LOOKBACK:]):
+        if is_label(previous):
+            return None
+        if is_address(previous):
+            return (1, []) if previous == line else None
+        if "A" in dest(previous):
+            return None
+    return None
+
+
+def remove_reload(output: typing.List[str], lines: typing.List[str],
+                  i: int) -> Match:
+    """Drops "D=M" if D and M are already equal."""
+    if lines[i] == "D=M" and output and output[-1] in ("M=D", "D=M", "MD=M"):
+        return 1, []
+    return None
+
+
+def remove_dead_d_store(output: typing.List[str], lines: typing.List[str],
+                        i: int) -> Match:
+    """Drops a write to D that is overwritten before it is read."""
+    line = lines[i]
+    if is_address(line) or is_label(line) or dest(line) != "D" or \
+            has_jump(line):
+        return None
+    for following in lines[i + 1:i + 1 + LOOKAHEAD]:
+        if is_label(following) or has_jump(following):
+            return None
+        if is_address(following):
+            continue
+        if "D" in comp(following):
+            return None
+        if "D" in dest(following):
+            return 1, []
+    return None
+
+
+# The rule table: name, the lowest -O level the rule runs at, and the rule.
+# At every instruction, the first matching rule wins.
+RULES = [
+    ("push/pop fusion", 2, fuse_push_pop),
+    ("SP increment/decrement fusion", 1, fuse_stack_increment),
+    ("redundant address loads", 1, remove_redundant_address),
+    ("redundant D reloads", 1, remove_reload),
+    ("dead D stores", 2, remove_dead_d_store),
+]
+
+
+class PeepholeOptimizer:
+    """Sits between a CodeWriter and the output file: buffers the emitted
+    Hack assembly in windows, rewrites each window with a table of peephole
+    rules and writes the result to the output stream.
+
+    Every rule only looks at straight-line code and stops at labels, so
+    windows are cut right before a label whenever possible.
+
+    Comment lines (such as the source markers of the CodeWriter) are kept in
+    place: the rules don't see them, and every instruction a rule writes
+    stays after the comments that preceded the first instruction it
+    replaced.
+    """
+
+    def __init__(self, output_stream: typing.TextIO, level: int = 1,
+                 rules: typing.Optional[typing.List[
+                     typing.Tuple[str, int, Rule]]] = None,
+                 window_size: int = WINDOW_SIZE) -> None:
+        """Initializes the optimizer.
+
+        Args:
+            output_stream (typing.TextIO): receives the optimized code.
+            level (int): the optimization level. 1 runs the cheap rules once,
+                2 runs all rules until nothing changes.
+            rules: the rule table to use instead of RULES.
+            window_size (int): the number of buffered instructions after
+                which a window is optimized and written.
+        """
+        self.output_stream = output_stream
+        self.level = level
+        self.rules = [(name, rule) for name, min_level, rule in
+                      (RULES if rules is None else rules)
+                      if min_level <= level]
+        self.window_size = window_size
+        self.buffer = []
+        self.partial = ""
+        self.saved = collections.Counter(
+            {name: 0 for name, rule in self.rules})
+
+    def write(self, text: str) -> None:
+        """Buffers assembly code.
+
+        Args:
+            text (str): one or more instructions, each ending with "\\n".
+        """
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        self.buffer.extend(lines)
+        if len(self.buffer) >= self.window_size:
+            self.flush_window()
+
+    def flush_window(self) -> None:
+        """Optimizes and writes the buffer up to its last label (or, in long
+        straight-line code, up to its last A-instruction).
+        """
+        cut = len(self.buffer) - 1
+        while cut > 0 and not is_label(self.buffer[cut]):
+            cut -= 1
+        if cut == 0:
+            cut = len(self.buffer) - 1
+            while cut > 0 and not is_address(self.buffer[cut]):
+                cut -= 1
+        if cut == 0:
+            return
+        window, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        self.write_lines(self.optimize(window))
+
+    def flush(self) -> None:
+        """Optimizes and writes everything that is still buffered."""
+        if self.partial:
+            self.buffer.append(self.partial)
+            self.partial = ""
+        self.write_lines(self.optimize(self.buffer))
+        self.buffer = []
+
+    def write_lines(self, lines: typing.List[str]) -> None:
+        if lines:
+            self.output_stream.write("\n".join(lines) + "\n")
+
+    def optimize(self, lines: typing.List[str]) -> typing.List[str]:
+        """Applies the rules to a window of instructions.
+
+        Args:
+            lines (typing.List[str]): the instructions of the window.
+
+        Returns:
+            typing.List[str]: the optimized instructions.
+        """
+        # The comments, and for every instruction the index of the last
+        # comment before it.
+        comments = []
+        owners = []
+        instructions = []
+        for line in lines:
+            if is_comment(line):
+                comments.append(line)
+            else:
+                instructions.append(line)
+                owners.append(len(comments) - 1)
+        lines = instructions
+
+        passes = MAX_PASSES if self.level >= 2 else 1
+        for _ in range(passes):
+            output = []
+            output_owners = []
+            changed = False
+            i = 0
+            while i < len(lines):
+                for name, rule in self.rules:
+                    match = rule(output, lines, i)
+                    if match is not None:
+                        consumed, replacement = match
+                        self.saved[name] += consumed - len(replacement)
+                        output.extend(replacement)
+                        output_owners.extend([owners[i]] * len(replacement))
+                        i += consumed
+                        changed = True
+                        break
+                else:
+                    output.append(lines[i])
+                    output_owners.append(owners[i])
+                    i += 1
+            lines, owners = output, output_owners
+            if not changed:
+                break
+
+        if not comments:
+            return lines
+        result = []
+        next_comment = 0
+        for line, owner in zip(lines, owners):
+            if next_comment <= owner:
+                result.extend(comments[next_comment:owner + 1])
+                next_comment = owner + 1
+            result.append(line)
+        result.extend(comments[next_comment:])
+        return result
+
+    def report(self) -> str:
+        """
+        Returns:
+            str: how many instructions each rule saved, one rule per line.
+        """
+        return format_report(self.saved)
+
+
+def format_report(saved: typing.Counter[str]) -> str:
+    """
+    Args:
+        saved (typing.Counter[str]): the number of instructions each rule
+            saved, e.g. the sum of the savings of several optimizers.
+
+    Returns:
+        str: how many instructions each rule saved, one rule per line.
+    """
+    report = [f"{name}: {count} instructions saved"
+              for name, count in saved.items()]
+    report.append(f"total: {sum(saved.values())} instructions saved")
+    return "\n".join(report)
@@ -0,0 +1,138 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import typing
+
+
+# The prefix of the source markers written by a CodeWriter with source_map.
+MARKER_PREFIX = "//#"
+
+# Code before the first source marker, i.e. the bootstrap code and the
+# shared routines.
+BOOTSTRAP = "(bootstrap)"
+
+
+class Entry(typing.NamedTuple):
+    """The ROM addresses [start, end) of the code of a single VM command."""
+    file_name: str
+    line: int
+    command_type: str
+    segment: str
+    function: str
+    start: int
+    end: int
+
+
+class SourceMap:
+    """Sits between a CodeWriter (or a PeepholeOptimizer) and the output
+    stream: removes the source markers from the code written to it, and
+    counts the instructions that follow every marker, which gives the ROM
+    addresses of the code of every VM command.
+    """
+
+    def __init__(self, output_stream: typing.TextIO) -> None:
+        """
+        Args:
+            output_stream (typing.TextIO): receives the code, without the
+                source markers.
+        """
+        self.output_stream = output_stream
+        self.entries = []
+        self.partial = ""
+        self.address = 0
+        self.current = Entry(BOOTSTRAP, 0, BOOTSTRAP, "", BOOTSTRAP, 0, 0)
+
+    def write(self, text: str) -> None:
+        """Writes code and maps it to the command of the last marker.
+
+        Args:
+            text (str): lines of Hack assembly code. A trailing partial line
+                is kept until the rest of it is written.
+        """
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        code = []
+        for line in lines:
+            if line.startswith(MARKER_PREFIX):
+                self.close_entry()
+                file_name, number, command_type, segment, function = \
+                    line[len(MARKER_PREFIX):].rsplit(":", 4)
+                self.current = Entry(file_name, int(number), command_type,
+                                     segment, function, self.address, 0)
+                continue
+            if line and line[0] != "(" and not line.startswith("//"):
+                self.address += 1
+            code.append(line)
+        if code:
+            self.output_stream.write("\n".join(code) + "\n")
+
+    def close_entry(self) -> None:
+        self.entries.append(self.current._replace(end=self.address))
+
+    def flush(self) -> None:
+        """Maps the rest of the code. Call once everything has been
+        written.
+        """
+        if self.partial:
+            self.write("\n")
+        self.close_entry()
+        self.current = self.current._replace(start=self.address)
+
+    def write_map(self, map_file: typing.TextIO) -> None:
+        """Writes the source map: a line "start end file.vm:line type
+        [segment] function" for every command, where [start, end) are the
+        ROM addresses of its code.
+
+        Args:
+            map_file (typing.TextIO): the file to write to.
+        """
+        for entry in self.entries:
+            source = BOOTSTRAP if entry.file_name == BOOTSTRAP else \
+                f"{entry.file_name}.vm:{entry.line}"
+            description = " ".join(dict.fromkeys(part for part in (
+                entry.command_type, entry.segment, entry.function) if part))
+            map_file.write(f"{entry.start}\t{entry.end}\t{source}\t"
+                           f"{description}\n")
+
+    def sizes(self, field: str) -> typing.Counter[str]:
+        """
+        Args:
+            field (str): the field of the entries to group by, e.g.
+                "command_type" or "function".
+
+        Returns:
+            typing.Counter[str]: the number of instructions of every value
+            of the field.
+        """
+        sizes = collections.Counter()
+        for entry in self.entries:
+            key = getattr(entry, field)
+            if key:
+                sizes[key] += entry.end - entry.start
+        return sizes
+
+    def report(self, top: int = 20) -> str:
+        """
+        Args:
+            top (int): the number of functions to list.
+
+        Returns:
+            str: the number of instructions per command type, segment,
+            function and file, largest first.
+        """
+        total = self.address
+        lines = [f"code size: {total} instructions"]
+        for title, field, limit in (("command type", "command_type", None),
+                                    ("segment", "segment", None),
+                                    ("function", "function", top),
+                                    ("file", "file_name", None)):
+            lines.append(f"by {title}:")
+            for key, size in self.sizes(field).most_common(limit):
+                lines.append(f"{size:>10} {100 * size / max(total, 1):6.2f}% "
+                             f"{key}")
+        return "\n".join(lines)
@@ -0,0 +1,360 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+from CodeWriter import CodeWriter, SEGMENT_BASES, POINTERS, FULL_RANGE, \
+    BOOLEAN_RANGE, compact_labels
+
+
+# Stores the cached value on top of the stack in RAM.
+SPILL = "@SP\nAM=M+1\nA=A-1\nM=D\n"
+# Moves the value on top of the stack from RAM into D.
+FILL = "@SP\nAM=M-1\nD=M\n"
+# Points A at the topmost stack entry in RAM and pops it; the cached value
+# (in D) is the second operand.
+POP_OPERAND = "@SP\nAM=M-1\n"
+
+# Loads the value of a segment entry into D, formatted with the index, the
+# pointer it stands for and the file name (for statics).
+LOAD_TEMPLATES = {
+    **{segment: f"@{base}\nD=M\n@{{index}}\nA=D+A\nD=M\n"
+       for segment, base in SEGMENT_BASES.items()},
+    "temp": "@{temp}\nD=M\n",
+    "pointer": "@{pointer}\nD=M\n",
+    "static": "@{file_name}.{index}\nD=M\n",
+}
+
+# Stores D in a segment entry. Entries of the pointer-based segments are
+# reached by incrementing A up to this index, and through R13 and R14 beyond
+# it.
+MAX_INCREMENTED_INDEX = 8
+STORE_TEMPLATES = {
+    "temp": "@{temp}\nM=D\n",
+    "pointer": "@{pointer}\nM=D\n",
+    "static": "@{file_name}.{index}\nM=D\n",
+}
+INCREMENTED_STORE_TEMPLATE = "@{base}\nA=M\n{increments}M=D\n"
+INDIRECT_STORE_TEMPLATE = ("@R13\nM=D\n@{base}\nD=M\n@{index}\nD=D+A\n"
+                           "@R14\nM=D\n@R13\nD=M\n@R14\nA=M\nM=D\n")
+
+# The computation of every command, applied to the cached value (D) and the
+# entry below it (M), and leaving the result in D.
+BINARY_COMPUTATIONS = {"add": "D=D+M\n", "sub": "D=M-D\n", "and": "D=D&M\n",
+                       "or": "D=D|M\n"}
+UNARY_COMPUTATIONS = {"neg": "D=-D\n", "not": "D=!D\n",
+                      "shiftleft": "D=D<<\n", "shiftright": "D=D>>\n"}
+
+# Applies a command to the cached value (D) and a constant (A).
+IMMEDIATE_COMPUTATIONS = {"add": "D=D+A\n", "sub": "D=D-A\n",
+                          "and": "D=D&A\n", "or": "D=D|A\n"}
+# Applies a command to the cached value (in M) and a constant (in D).
+SAVED_COMPUTATIONS = {"add": "D=D+M\n", "sub": "D=M-D\n", "and": "D=D&M\n",
+                      "or": "D=D|M\n"}
+
+# Constants that a single instruction can load into D.
+SMALL_CONSTANTS = {0: "D=0\n", 1: "D=1\n", -1: "D=-1\n"}
+
+# Compares the entry below the cached value (x) with it (y) by subtraction,
+# leaving the boolean in D, so it may only be used when x-y cannot overflow.
+CACHED_COMPARISON_TEMPLATE = (POP_OPERAND + "D=M-D\n@_TRUE\nD;{jump}\nD=0\n"
+                              "@_END\n0;JMP\n(_TRUE)\nD=-1\n(_END)\n")
+CACHED_COMPARISON_PARTS = {
+    command: CACHED_COMPARISON_TEMPLATE.format(
+        jump="J" + command.upper()).split("_")
+    for command in ("eq", "gt", "lt")}
+COMPACT_CACHED_COMPARISON_PARTS = {
+    command: compact_labels(CACHED_COMPARISON_TEMPLATE.format(
+        jump="J" + command.upper())).split("_")
+    for command in ("eq", "gt", "lt")}
+
+
+class StackCachingCodeWriter(CodeWriter):
+    """A CodeWriter that keeps the value on top of the stack in D instead of
+    in RAM, for as long as control can't leave or enter the code: pushes
+    load D without storing it, and arithmetic and pops take their last
+    operand from D. The value is spilled to RAM right before labels,
+    "goto", "call", "function" and "return", before shared pushes and pops,
+    before comparisons that need the sign checks of the inline templates
+    and at the end of the commands, so that every other piece of code (and
+    every jump target) sees the stack of the inline templates.
+    "if-goto" consumes the cached value directly.
+
+    While a value is cached, SP points to where it would be stored.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        """Initializes the CodeWriter. Takes the arguments of CodeWriter."""
+        super().__init__(*args, **kwargs)
+        # Whether the value on top of the stack is cached in D.
+        self.cached = False
+        # The code that loads every segment entry seen so far into D, and
+        # that stores D in it.
+        self.load_codes = {}
+        self.store_codes = {}
+        self.cached_comparison_parts = COMPACT_CACHED_COMPARISON_PARTS \
+            if self.intern_labels else CACHED_COMPARISON_PARTS
+
+    def set_file_name(self, filename: str) -> None:
+        """Informs the code writer that the translation of a new VM file is
+        started.
+
+        Args:
+            filename (str): The name of the VM file.
+        """
+        self.spill()
+        super().set_file_name(filename)
+        self.load_codes.clear()
+        self.store_codes.clear()
+
+    def flush(self) -> None:
+        """Spills the cached value, since the end of the commands ends the
+        block, and writes the buffered code to the output stream. Call once
+        all commands have been written.
+        """
+        self.spill()
+        super().flush()
+
+    def spill(self) -> None:
+        """Stores the cached value, if any, on top of the stack in RAM."""
+        if self.cached:
+            self.emit(SPILL)
+            self.cached = False
+
+    def fill(self) -> None:
+        """Caches the value on top of the stack, if it isn't cached yet."""
+        if not self.cached:
+            self.emit(FILL)
+            self.cached = True
+
+    def write_arithmetic(self, command: str) -> None:
+        """Writes assembly code that is the translation of the given
+        arithmetic command, leaving the result in D.
+
+        Args:
+            command (str): an arithmetic command.
+        """
+        if command in ("eq", "gt", "lt"):
+            self.write_comparison(command)
+            return
+        if self.fast_compares:
+            self.track_arithmetic_range(command)
+        self.fill()
+        if command in UNARY_COMPUTATIONS:
+            self.emit(UNARY_COMPUTATIONS[command])
+        else:
+            self.emit(POP_OPERAND + BINARY_COMPUTATIONS[command])
+
+    def write_comparison(self, command: str) -> None:
+        """Writes assembly code that is the translation of eq, gt or lt.
+        eq, and with fast_compares the comparisons that can't overflow,
+        leave the result in D. The others spill and use the templates of
+        CodeWriter.
+
+        Args:
+            command (str): "eq", "gt" or "lt".
+        """
+        safe = command == "eq"
+        if self.fast_compares:
+            y = self.pop_range()
+            x = self.pop_range()
+            safe = safe or not self.may_overflow(x, y)
+            self.push_range(x)
+            self.push_range(y)
+        if not safe:
+            self.spill()
+            super().write_comparison(command)
+            return
+        if self.fast_compares:
+            self.pop_range()
+            self.pop_range()
+            self.push_range(BOOLEAN_RANGE)
+        self.fill()
+        self.emit(self.label_prefix().join(
+            self.cached_comparison_parts[command]))
+
+    def write_if_comparison(self, condition: str, label: str) -> None:
+        """Writes assembly code that pops two values x and y and jumps to the
+        label if the condition holds between them.
+
+        Args:
+            condition (str): "eq", "gt", "lt", "ne", "le" or "ge".
+            label (str): the label to go to.
+        """
+        safe = condition in ("eq", "ne")
+        if self.fast_compares:
+            y = self.pop_range()
+            x = self.pop_range()
+            safe = safe or not self.may_overflow(x, y)
+            self.push_range(x)
+            self.push_range(y)
+        if not safe:
+            self.spill()
+            super().write_if_comparison(condition, label)
+            return
+        self.stack_ranges.clear()
+        self.fill()
+        self.cached = False
+        self.emit(f"{POP_OPERAND}D=M-D\n@{self.current_function}${label}\n"
+                  f"D;J{condition.upper()}\n")
+
+    def write_if_not(self, label: str) -> None:
+        """Writes assembly code that pops a value and jumps to the label
+        unless it is -1.
+
+        Args:
+            label (str): the label to go to.
+        """
+        self.stack_ranges.clear()
+        self.fill()
+        self.cached = False
+        self.emit(f"@{self.current_function}${label}\nD+1;JNE\n")
+
+    def write_arithmetic_constant(self, command: str, constant: int) -> None:
+        """Writes assembly code that applies a binary arithmetic command to
+        the value on top of the stack and a constant, leaving the result in
+        D.
+
+        Args:
+            command (str): "add", "sub", "and" or "or".
+            constant (int): the second operand, a 16-bit signed value.
+        """
+        if self.fast_compares:
+            x = self.pop_range()
+            self.push_range(self.binary_range(command, x,
+                                              (constant, constant)))
+        self.fill()
+        if command in ("add", "sub") and constant == 1:
+            self.emit("D=D" + ("+" if command == "add" else "-") + "1\n")
+        elif constant >= 0:
+            self.emit(f"@{constant}\n" + IMMEDIATE_COMPUTATIONS[command])
+        else:
+            self.emit("@R13\nM=D\n" + self.load_constant(constant) +
+                      "@R13\n" + SAVED_COMPUTATIONS[command])
+
+    def write_push(self, segment: str, index: int) -> None:
+        """Writes assembly code that loads a segment entry into D, which
+        becomes the cached value.
+
+        Args:
+            segment (str): the memory segment to push from.
+            index (int): the index in the memory segment.
+        """
+        if self.uses_shared_push_pop(segment):
+            self.spill()
+            super().write_push(segment, index)
+            return
+        code = self.load_codes.get((segment, index))
+        if code is None:
+            code = self.load_codes[segment, index] = self.format_load(
+                segment, index)
+        if not code:
+            return
+        if self.fast_compares:
+            self.push_range((index, index) if segment == "constant"
+                            else FULL_RANGE)
+        self.spill()
+        self.emit(code)
+        self.cached = True
+
+    def write_pop(self, segment: str, index: int) -> None:
+        """Writes assembly code that stores the cached value in a segment
+        entry.
+
+        Args:
+            segment (str): the memory segment to pop to.
+            index (int): the index in the memory segment.
+        """
+        if self.uses_shared_push_pop(segment):
+            self.spill()
+            super().write_pop(segment, index)
+            return
+        code = self.store_codes.get((segment, index))
+        if code is None:
+            code = self.store_codes[segment, index] = self.format_store(
+                segment, index)
+        if not code:
+            return
+        if self.fast_compares:
+            self.pop_range()
+        self.fill()
+        self.emit(code)
+        self.cached = False
+
+    def format_load(self, segment: str, index: int) -> str:
+        """
+        Args:
+            segment (str): the memory segment.
+            index (int): the index in the memory segment.
+
+        Returns:
+            str: the code that loads the entry into D, or nothing if the
+            segment (or the pointer index) doesn't exist.
+        """
+        if segment == "constant":
+            return SMALL_CONSTANTS.get(index) or self.load_constant(index)
+        template = LOAD_TEMPLATES.get(segment)
+        if template is None or (segment == "pointer" and
+                                index not in POINTERS):
+            return ""
+        return template.format(index=index, temp=5 + index,
+                               pointer=POINTERS.get(index),
+                               file_name=self.file_name)
+
+    def format_store(self, segment: str, index: int) -> str:
+        """
+        Args:
+            segment (str): the memory segment.
+            index (int): the index in the memory segment.
+
+        Returns:
+            str: the code that stores D in the entry, or nothing if the
+            segment (or the pointer index) doesn't exist.
+        """
+        if segment in SEGMENT_BASES:
+            base = SEGMENT_BASES[segment]
+            if index <= MAX_INCREMENTED_INDEX:
+                return INCREMENTED_STORE_TEMPLATE.format(
+                    base=base, increments="A=A+1\n" * index)
+            return INDIRECT_STORE_TEMPLATE.format(base=base, index=index)
+        template = STORE_TEMPLATES.get(segment)
+        if template is None or (segment == "pointer" and
+                                index not in POINTERS):
+            return ""
+        return template.format(index=index, temp=5 + index,
+                               pointer=POINTERS.get(index),
+                               file_name=self.file_name)
+
+    def write_label(self, label: str) -> None:
+        self.spill()
+        super().write_label(label)
+
+    def write_goto(self, label: str) -> None:
+        self.spill()
+        super().write_goto(label)
+
+    def write_if(self, label: str) -> None:
+        """Writes assembly code that pops a value and jumps to the label if
+        it is true.
+
+        Args:
+            label (str): the label to go to.
+        """
+        self.stack_ranges.clear()
+        self.fill()
+        self.cached = False
+        self.emit(f"@{self.current_function}${label}\nD;JNE\n")
+
+    def write_function(self, function_name: str, n_vars: int) -> None:
+        self.spill()
+        super().write_function(function_name, n_vars)
+
+    def write_call(self, function_name: str, n_args: int) -> None:
+        self.spill()
+        super().write_call(function_name, n_args)
+
+    def write_return(self) -> None:
+        self.spill()
+        super().write_return()
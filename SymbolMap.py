@@ -0,0 +1,66 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+
+
+# The prefix of the symbol markers written by a CodeWriter with symbol_map.
+MARKER_PREFIX = "//="
+
+
+class SymbolMap:
+    """Sits between a CodeWriter (or a PeepholeOptimizer) and the output
+    stream, like a SourceMap: removes the symbol markers from the code
+    written to it, and keeps the original name of every interned label.
+    """
+
+    def __init__(self, output_stream: typing.TextIO) -> None:
+        """
+        Args:
+            output_stream (typing.TextIO): receives the code, without the
+                symbol markers.
+        """
+        self.output_stream = output_stream
+        # The original name of every interned label, in order of appearance.
+        self.names = {}
+        self.partial = ""
+
+    def write(self, text: str) -> None:
+        """Writes code, keeping the names of its symbol markers.
+
+        Args:
+            text (str): lines of Hack assembly code. A trailing partial line
+                is kept until the rest of it is written.
+        """
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        code = []
+        for line in lines:
+            if line.startswith(MARKER_PREFIX):
+                label, name = line[len(MARKER_PREFIX):].split(" ", 1)
+                self.names[label] = name
+            else:
+                code.append(line)
+        if code:
+            self.output_stream.write("\n".join(code) + "\n")
+
+    def flush(self) -> None:
+        """Writes the rest of the code. Call once everything has been
+        written.
+        """
+        if self.partial:
+            self.write("\n")
+
+    def write_map(self, map_file: typing.TextIO) -> None:
+        """Writes the symbol map: a line "label name" for every interned
+        label.
+
+        Args:
+            map_file (typing.TextIO): the file to write to.
+        """
+        for label, name in self.names.items():
+            map_file.write(f"{label}\t{name}\n")
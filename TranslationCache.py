@@ -0,0 +1,146 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import functools
+import glob
+import hashlib
+import json
+import os
+import typing
+
+
+# The default bound on the total size of the cache entries, in bytes.
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# Input files are hashed in chunks of this many bytes.
+CHUNK_SIZE = 1024 * 1024
+
+
+@functools.lru_cache(maxsize=None)
+def translator_version() -> str:
+    """
+    Returns:
+        str: a hash of the translator's source files, so that changing the
+        translator invalidates every cached translation. It is computed once
+        per process, which is also the version of the modules it runs.
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+        with open(path, "rb") as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()
+
+
+class TranslationCache:
+    """An on-disk cache of translated .vm files.
+
+    Every entry holds the assembly code that translate_file wrote for one
+    file. It is keyed by the file's name and content, the translator version
+    and the translation options, which is everything the translation depends
+    on. Entries are evicted least recently used first once their total size
+    exceeds max_size.
+    """
+
+    def __init__(self, directory: str,
+                 max_size: int = DEFAULT_MAX_SIZE) -> None:
+        """Opens the cache, creating its directory if needed.
+
+        Args:
+            directory (str): the directory holding the cache entries.
+            max_size (int): the bound on the total size of the entries, in
+                bytes.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.version = translator_version()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, input_path: str, options: typing.Dict) -> str:
+        """
+        Args:
+            input_path (str): the path of a .vm file.
+            options (typing.Dict): the keyword arguments of translate_file.
+
+        Returns:
+            str: the key of the file's translation.
+        """
+        digest = hashlib.sha256()
+        digest.update(self.version.encode())
+        digest.update(repr(sorted(options.items())).encode())
+        digest.update(os.path.basename(input_path).encode())
+        with open(input_path, "rb") as input_file:
+            for chunk in iter(lambda: input_file.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) \
+            -> typing.Optional[typing.Tuple[str, typing.Counter[str]]]:
+        """
+        Args:
+            key (str): the key of a translation.
+
+        Returns:
+            typing.Optional[typing.Tuple[str, typing.Counter[str]]]: the
+            cached assembly code and peephole savings, or None on a miss.
+        """
+        path = self.path(key)
+        try:
+            with open(path, "r") as entry_file:
+                entry = json.load(entry_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["fragment"], collections.Counter(entry["saved"])
+
+    def put(self, key: str, fragment: str,
+            saved: typing.Counter[str]) -> None:
+        """Stores a translation. Call evict() once done storing. A
+        translation larger than max_size isn't stored, since evict() would
+        remove it right away.
+
+        Args:
+            key (str): the key of the translation.
+            fragment (str): the assembly code.
+            saved (typing.Counter[str]): the peephole savings.
+        """
+        if len(fragment) > self.max_size:
+            return
+        path = self.path(key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as entry_file:
+            json.dump({"fragment": fragment, "saved": saved}, entry_file)
+        os.replace(temporary_path, path)
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the total size of
+        the entries is within max_size.
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+        total_size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
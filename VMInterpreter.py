@@ -0,0 +1,410 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import argparse
+import collections
+import json
+import os
+import typing
+from Parser import Parser, Command, C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, \
+    C_GOTO, C_IF, C_FUNCTION, C_RETURN, C_CALL
+
+
+# The operations of decoded commands.
+PUSH_CONSTANT, PUSH_SEGMENT, PUSH_ADDRESS, POP_SEGMENT, POP_ADDRESS, ADD, \
+    SUB, NEG, EQ, GT, LT, AND, OR, NOT, SHIFT_LEFT, SHIFT_RIGHT, NOP, GOTO, \
+    IF_GOTO, HALT, FUNCTION, CALL, RETURN = range(23)
+
+ARITHMETIC_OPERATIONS = {
+    "add": ADD, "sub": SUB, "neg": NEG, "eq": EQ, "gt": GT, "lt": LT,
+    "and": AND, "or": OR, "not": NOT, "shiftleft": SHIFT_LEFT,
+    "shiftright": SHIFT_RIGHT}
+
+# The RAM addresses of the segment pointers, and of the fixed segments.
+SEGMENT_POINTERS = {"local": 1, "argument": 2, "this": 3, "that": 4}
+SP, LCL, ARG, THIS, THAT = range(5)
+TEMP_BASE = 5
+POINTER_BASE = 3
+FIRST_STATIC = 16
+STACK_BASE = 256
+RAM_SIZE = 32768
+
+ENTRY_POINT = "Sys.init"
+DEFAULT_MAX_STEPS = 100_000_000
+
+# Blocks that run at least this fraction as often as the hottest block are
+# hot.
+HOT_FRACTION = 0.01
+
+
+class Profile:
+    """The execution profile of a program: how often every function was
+    called, how often every basic block ran and how often every "if-goto"
+    jumped. Blocks and branches are identified by their file and lines, so
+    a profile stays valid for any translation of the same .vm files.
+    """
+
+    def __init__(self, steps: int = 0,
+                 calls: typing.Optional[typing.Dict[str, int]] = None,
+                 blocks: typing.Optional[typing.List[typing.Dict]] = None,
+                 branches: typing.Optional[typing.List[typing.Dict]] = None) \
+            -> None:
+        """
+        Args:
+            steps (int): the number of commands executed.
+            calls (typing.Optional[typing.Dict[str, int]]): the number of
+                calls of every function.
+            blocks (typing.Optional[typing.List[typing.Dict]]): every basic
+                block, as its "file", its first and last line ("start" and
+                "end") and the number of times it ran ("count").
+            branches (typing.Optional[typing.List[typing.Dict]]): every
+                "if-goto", as its "file" and "line", the number of times it
+                ran ("count") and jumped ("taken").
+        """
+        self.steps = steps
+        self.calls = calls or {}
+        self.blocks = blocks or []
+        self.branches = branches or []
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as profile_file:
+            json.dump({"steps": self.steps, "calls": self.calls,
+                       "blocks": self.blocks, "branches": self.branches},
+                      profile_file, indent=1)
+
+    @classmethod
+    def load(cls, path: str) -> "Profile":
+        with open(path, "r") as profile_file:
+            return cls(**json.load(profile_file))
+
+    def hot_lines(self, file_name: str,
+                  fraction: float = HOT_FRACTION) -> typing.Set[int]:
+        """
+        Args:
+            file_name (str): the name of a .vm file, without its extension.
+            fraction (float): blocks that run at least this fraction as often
+                as the hottest block are hot.
+
+        Returns:
+            typing.Set[int]: the lines of the file that are in hot blocks.
+        """
+        hottest = max((block["count"] for block in self.blocks), default=0)
+        threshold = max(1, hottest * fraction)
+        return {line for block in self.blocks
+                if block["file"] == file_name and block["count"] >= threshold
+                for line in range(block["start"], block["end"] + 1)}
+
+
+class VMInterpreter:
+    """Runs the parsed commands of a whole program, with the memory layout
+    of the Hack platform, and profiles it. Every command is decoded once,
+    up front, into an operation and its operands.
+    """
+
+    def __init__(self, files: typing.List[typing.Tuple[str,
+                                                       typing.List[Command]]]) \
+            -> None:
+        """Loads a program.
+
+        Args:
+            files (typing.List[typing.Tuple[str, typing.List[Command]]]): the
+                name of every .vm file, without its extension, and its
+                commands.
+        """
+        self.file_names = []
+        self.commands = []
+        for file_name, commands in files:
+            for command in commands:
+                self.file_names.append(file_name)
+                self.commands.append(command)
+        self.statics = {}
+        self.program = self.decode()
+        self.counts = [0] * len(self.program)
+        self.taken = [0] * len(self.program)
+        self.ram = [0] * RAM_SIZE
+        self.ram[SP] = STACK_BASE
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+        if ENTRY_POINT in self.functions:
+            # Like the bootstrap code: call Sys.init, which never returns.
+            self.ram[SP] = STACK_BASE + 5
+            self.ram[STACK_BASE] = len(self.program)
+            self.ram[ARG] = STACK_BASE
+            self.ram[LCL] = STACK_BASE + 5
+            self.pc = self.functions[ENTRY_POINT]
+
+    def decode(self) -> typing.List[typing.Tuple[int, int, int]]:
+        """
+        Returns:
+            typing.List[typing.Tuple[int, int, int]]: the operation and
+            operands of every command.
+        """
+        self.functions = {}
+        labels = {}
+        function = ""
+        for index, command in enumerate(self.commands):
+            if command.opcode == C_FUNCTION:
+                function = command.arg1
+                self.functions[function] = index
+            elif command.opcode == C_LABEL:
+                labels[function, command.arg1] = index
+        program = []
+        function = ""
+        for index, command in enumerate(self.commands):
+            opcode, arg1, arg2 = command.opcode, command.arg1, command.arg2
+            if opcode == C_PUSH or opcode == C_POP:
+                push = opcode == C_PUSH
+                if arg1 == "constant":
+                    decoded = (PUSH_CONSTANT, arg2, 0)
+                elif arg1 in SEGMENT_POINTERS:
+                    decoded = (PUSH_SEGMENT if push else POP_SEGMENT,
+                               SEGMENT_POINTERS[arg1], arg2)
+                else:
+                    decoded = (PUSH_ADDRESS if push else POP_ADDRESS,
+                               self.address(index, arg1, arg2), 0)
+            elif opcode == C_ARITHMETIC:
+                decoded = (ARITHMETIC_OPERATIONS[arg1], 0, 0)
+            elif opcode == C_LABEL:
+                decoded = (NOP, 0, 0)
+            elif opcode == C_GOTO or opcode == C_IF:
+                target = labels.get((function, arg1))
+                if target is None:
+                    raise ValueError(f"unknown label '{arg1}' in {function}")
+                if opcode == C_GOTO and target == index - 1:
+                    decoded = (HALT, 0, 0)
+                else:
+                    decoded = (GOTO if opcode == C_GOTO else IF_GOTO,
+                               target, 0)
+            elif opcode == C_FUNCTION:
+                function = arg1
+                decoded = (FUNCTION, arg2, 0)
+            elif opcode == C_CALL:
+                if arg1 not in self.functions:
+                    raise ValueError(f"call of unknown function '{arg1}'")
+                decoded = (CALL, self.functions[arg1], arg2)
+            elif opcode == C_RETURN:
+                decoded = (RETURN, 0, 0)
+            else:
+                raise ValueError(f"can't interpret {command}")
+            program.append(decoded)
+        return program
+
+    def address(self, index: int, segment: str, offset: int) -> int:
+        """
+        Args:
+            index (int): the index of the command.
+            segment (str): "static", "temp" or "pointer".
+            offset (int): the index in the segment.
+
+        Returns:
+            int: the RAM address of the segment entry. Statics are allocated
+            in order of first use, like the Hack assembler does.
+        """
+        if segment == "temp":
+            return TEMP_BASE + offset
+        if segment == "pointer":
+            return POINTER_BASE + offset
+        if segment == "static":
+            key = (self.file_names[index], offset)
+            if key not in self.statics:
+                self.statics[key] = FIRST_STATIC + len(self.statics)
+            return self.statics[key]
+        raise ValueError(f"unknown segment '{segment}'")
+
+    def run(self, max_steps: int = DEFAULT_MAX_STEPS) -> int:
+        """Runs the program until it halts (jumps to itself), runs past its
+        last command or max_steps more commands have run.
+
+        Args:
+            max_steps (int): the maximal number of commands to run.
+
+        Returns:
+            int: the total number of commands run so far.
+        """
+        program, ram, counts, taken = \
+            self.program, self.ram, self.counts, self.taken
+        pc, sp = self.pc, ram[SP]
+        size = len(program)
+        steps = 0
+        while steps < max_steps and pc < size:
+            counts[pc] += 1
+            steps += 1
+            operation, x, y = program[pc]
+            pc += 1
+            if operation == PUSH_CONSTANT:
+                ram[sp] = x
+                sp += 1
+            elif operation == PUSH_SEGMENT:
+                ram[sp] = ram[(ram[x] + y) & 0x7FFF]
+                sp += 1
+            elif operation == POP_SEGMENT:
+                sp -= 1
+                ram[(ram[x] + y) & 0x7FFF] = ram[sp]
+            elif operation == PUSH_ADDRESS:
+                ram[sp] = ram[x]
+                sp += 1
+            elif operation == POP_ADDRESS:
+                sp -= 1
+                ram[x] = ram[sp]
+            elif operation <= SHIFT_RIGHT:
+                if operation in (NEG, NOT, SHIFT_LEFT, SHIFT_RIGHT):
+                    value = ram[sp - 1]
+                    if operation == NEG:
+                        value = -value
+                    elif operation == NOT:
+                        value = ~value
+                    elif operation == SHIFT_LEFT:
+                        value <<= 1
+                    else:
+                        value >>= 1
+                else:
+                    sp -= 1
+                    a, b = ram[sp - 1], ram[sp]
+                    if operation == ADD:
+                        value = a + b
+                    elif operation == SUB:
+                        value = a - b
+                    elif operation == AND:
+                        value = a & b
+                    elif operation == OR:
+                        value = a | b
+                    elif operation == EQ:
+                        value = -(a == b)
+                    elif operation == GT:
+                        value = -(a > b)
+                    else:
+                        value = -(a < b)
+                ram[sp - 1] = ((value + 0x8000) & 0xFFFF) - 0x8000
+            elif operation == GOTO:
+                pc = x
+            elif operation == IF_GOTO:
+                sp -= 1
+                if ram[sp]:
+                    taken[pc - 1] += 1
+                    pc = x
+            elif operation == FUNCTION:
+                for _ in range(x):
+                    ram[sp] = 0
+                    sp += 1
+            elif operation == CALL:
+                ram[sp:sp + 5] = [pc, ram[LCL], ram[ARG], ram[THIS],
+                                  ram[THAT]]
+                sp += 5
+                ram[ARG] = sp - 5 - y
+                ram[LCL] = sp
+                pc = x
+            elif operation == RETURN:
+                frame = ram[LCL]
+                pc = ram[frame - 5]
+                ram[ram[ARG]] = ram[sp - 1]
+                sp = ram[ARG] + 1
+                ram[THAT], ram[THIS], ram[ARG], ram[LCL] = \
+                    ram[frame - 1], ram[frame - 2], ram[frame - 3], \
+                    ram[frame - 4]
+            elif operation == HALT:
+                self.halted = True
+                pc -= 1
+                break
+        ram[SP] = sp
+        self.pc = pc
+        self.steps += steps
+        return self.steps
+
+    def profile(self) -> Profile:
+        """
+        Returns:
+            Profile: the profile of everything run so far.
+        """
+        calls = collections.Counter()
+        blocks = []
+        branches = []
+        leader = True
+        for index, command in enumerate(self.commands):
+            opcode = command.opcode
+            file_name = self.file_names[index]
+            if opcode in (C_FUNCTION, C_LABEL) or \
+                    (index and self.file_names[index - 1] != file_name):
+                leader = True
+            if leader:
+                blocks.append({"file": file_name, "start": command.line,
+                               "end": command.line,
+                               "count": self.counts[index]})
+                leader = False
+            blocks[-1]["end"] = command.line
+            if opcode == C_FUNCTION:
+                calls[command.arg1] += self.counts[index]
+            elif opcode == C_IF:
+                branches.append({"file": file_name, "line": command.line,
+                                 "count": self.counts[index],
+                                 "taken": self.taken[index]})
+            if opcode in (C_GOTO, C_IF, C_CALL, C_RETURN):
+                leader = True
+        return Profile(self.steps, dict(calls), blocks, branches)
+
+
+def load_files(input_path: str) \
+        -> typing.List[typing.Tuple[str, typing.List[Command]]]:
+    """
+    Args:
+        input_path (str): a .vm file, or a directory of .vm files.
+
+    Returns:
+        typing.List[typing.Tuple[str, typing.List[Command]]]: the name of
+        every .vm file, without its extension, and its commands, in the
+        order that Main translates them in.
+    """
+    if os.path.isdir(input_path):
+        paths = [os.path.join(input_path, filename)
+                 for filename in sorted(os.listdir(input_path))]
+    else:
+        paths = [input_path]
+    files = []
+    for path in paths:
+        file_name, extension = os.path.splitext(os.path.basename(path))
+        if extension.lower() != ".vm":
+            continue
+        with open(path, "r") as input_file:
+            files.append((file_name, list(Parser(input_file))))
+    return files
+
+
+if "__main__" == __name__:
+    # Runs a program, reports the calls of its most called functions and
+    # its most biased branches, and saves its profile for Main.py --profile.
+    arg_parser = argparse.ArgumentParser(prog="VMInterpreter")
+    arg_parser.add_argument("input_path", help="a .vm file or a directory")
+    arg_parser.add_argument(
+        "--steps", type=int, default=DEFAULT_MAX_STEPS,
+        help="stop after this many commands if the program hasn't halted")
+    arg_parser.add_argument(
+        "-o", "--output",
+        help="the profile file (default: Prog.profile.json next to the "
+             "input)")
+    arg_parser.add_argument(
+        "--top", type=int, default=10,
+        help="report this many of the most called functions")
+    args = arg_parser.parse_args()
+    input_path = os.path.abspath(args.input_path)
+    interpreter = VMInterpreter(load_files(input_path))
+    interpreter.run(args.steps)
+    profile = interpreter.profile()
+    if os.path.isdir(input_path):
+        output_path = os.path.join(input_path, os.path.basename(input_path))
+    else:
+        output_path = os.path.splitext(input_path)[0]
+    profile.save(args.output or output_path + ".profile.json")
+    print(f"steps: {interpreter.steps}"
+          f"{'' if interpreter.halted else ' (did not halt)'}")
+    for name, calls in collections.Counter(profile.calls).most_common(
+            args.top):
+        print(f"{calls:>12} calls {name}")
+    for branch in sorted(profile.branches, key=lambda branch: branch["count"],
+                         reverse=True)[:args.top]:
+        print(f"{branch['count']:>12} runs {branch['file']}.vm:"
+              f"{branch['line']} taken "
+              f"{100 * branch['taken'] / max(branch['count'], 1):.1f}%")
@@ -0,0 +1,264 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command, CONDITIONS, C_ARITHMETIC, C_PUSH, C_POP, C_IF, \
+    C_ARITHMETIC_CONSTANT, C_IF_COMPARISON, C_IF_NOT
+
+
+# A rule gets the commands that are still pending, the newest last. If it
+# matches at the end of them, it returns how many of the newest commands it
+# consumed and which commands to put there instead.
+Rule = typing.Callable[[typing.List[Command]],
+                       typing.Optional[typing.Tuple[int, typing.List[Command]]]]
+
+# Every rule matches at most this many commands.
+WINDOW_SIZE = 3
+
+# Runs of pushed constants are held back until this many commands are
+# pending, so that nested constant expressions are folded completely.
+MAX_PENDING = 16
+
+# Constants that a single A-instruction can load. Other 16-bit values are
+# pushed as "push constant -n", which the CodeWriter loads as !(n-1).
+MAX_CONSTANT = 32767
+
+UNARY_FUNCTIONS = {
+    "neg": lambda y: -y,
+    "not": lambda y: ~y,
+    "shiftleft": lambda y: y << 1,
+    "shiftright": lambda y: y >> 1,
+}
+
+BINARY_FUNCTIONS = {
+    "add": lambda x, y: x + y,
+    "sub": lambda x, y: x - y,
+    "and": lambda x, y: x & y,
+    "or": lambda x, y: x | y,
+    "eq": lambda x, y: -(x == y),
+    "gt": lambda x, y: -(x > y),
+    "lt": lambda x, y: -(x < y),
+}
+
+# The binary commands that the CodeWriter can apply to a constant operand.
+CONSTANT_OPERAND_COMMANDS = ("add", "sub", "and", "or")
+
+# Applying the command with this constant leaves the other operand as is.
+IDENTITIES = {"add": 0, "sub": 0, "and": -1, "or": 0}
+
+# Unary commands that undo themselves.
+INVOLUTIONS = ("neg", "not")
+
+# The comparisons, and the conditions that hold when they are false.
+COMPARISONS = ("eq", "gt", "lt")
+NEGATIONS = {"eq": "ne", "gt": "le", "lt": "ge"}
+
+
+def wrap(value: int) -> int:
+    """
+    Args:
+        value (int): an integer.
+
+    Returns:
+        int: the value modulo 2^16, as a signed 16-bit integer.
+    """
+    return (value + 0x8000) % 0x10000 - 0x8000
+
+
+def constant(command: Command) -> typing.Optional[int]:
+    """
+    Args:
+        command (Command): a command.
+
+    Returns:
+        typing.Optional[int]: the pushed value if the command is
+        "push constant", otherwise None.
+    """
+    if command.opcode == C_PUSH and command.arg1 == "constant":
+        return command.arg2
+    return None
+
+
+def push_constant(value: int) -> Command:
+    return Command(C_PUSH, "constant", wrap(value))
+
+
+def is_arithmetic(command: Command, names: typing.Container[str]) -> bool:
+    return command.opcode == C_ARITHMETIC and command.arg1 in names
+
+
+def fold_unary(tail: typing.List[Command]) \
+        -> typing.Optional[typing.Tuple[int, typing.List[Command]]]:
+    """push constant y; neg -> push constant -y"""
+    if len(tail) < 2 or not is_arithmetic(tail[-1], UNARY_FUNCTIONS):
+        return None
+    y = constant(tail[-2])
+    if y is None:
+        return None
+    return 2, [push_constant(UNARY_FUNCTIONS[tail[-1].arg1](y))]
+
+
+def fold_binary(tail: typing.List[Command]) \
+        -> typing.Optional[typing.Tuple[int, typing.List[Command]]]:
+    """push constant x; push constant y; add -> push constant x+y"""
+    if len(tail) < 3 or not is_arithmetic(tail[-1], BINARY_FUNCTIONS):
+        return None
+    x, y = constant(tail[-3]), constant(tail[-2])
+    if x is None or y is None:
+        return None
+    return 3, [push_constant(BINARY_FUNCTIONS[tail[-1].arg1](x, y))]
+
+
+def specialize_constant_operand(tail: typing.List[Command]) \
+        -> typing.Optional[typing.Tuple[int, typing.List[Command]]]:
+    """push constant 1; add -> add the constant 1 in place, or nothing at all
+    if the constant doesn't change the other operand.
+    """
+    if len(tail) < 2 or \
+            not is_arithmetic(tail[-1], CONSTANT_OPERAND_COMMANDS):
+        return None
+    y = constant(tail[-2])
+    if y is None:
+        return None
+    command = tail[-1].arg1
+    if y == IDENTITIES[command]:
+        return 2, []
+    if command in ("add", "sub"):
+        # Small negative constants are cheaper to subtract than to add.
+        y = wrap(y if command == "add" else -y)
+        command = "add"
+        if -MAX_CONSTANT <= y < 0:
+            command, y = "sub", -y
+    return 2, [Command(C_ARITHMETIC_CONSTANT, command, y)]
+
+
+def merge_constant_operands(tail: typing.List[Command]) \
+        -> typing.Optional[typing.Tuple[int, typing.List[Command]]]:
+    """add the constant x; add the constant y -> add the constant x+y"""
+    if len(tail) < 2:
+        return None
+    first, second = tail[-2], tail[-1]
+    if first.opcode != C_ARITHMETIC_CONSTANT or \
+            second.opcode != C_ARITHMETIC_CONSTANT or \
+            first.arg1 not in ("add", "sub") or \
+            second.arg1 not in ("add", "sub"):
+        return None
+    total = (first.arg2 if first.arg1 == "add" else -first.arg2) + \
+        (second.arg2 if second.arg1 == "add" else -second.arg2)
+    return 2, [push_constant(total), Command(C_ARITHMETIC, "add", 0)]
+
+
+def cancel_push_pop(tail: typing.List[Command]) \
+        -> typing.Optional[typing.Tuple[int, typing.List[Command]]]:
+    """push local 2; pop local 2 -> nothing"""
+    if len(tail) < 2:
+        return None
+    push, pop = tail[-2], tail[-1]
+    if push.opcode == C_PUSH and pop.opcode == C_POP and \
+            push.arg1 == pop.arg1 and push.arg2 == pop.arg2:
+        return 2, []
+    return None
+
+
+def cancel_involution(tail: typing.List[Command]) \
+        -> typing.Optional[typing.Tuple[int, typing.List[Command]]]:
+    """not; not -> nothing"""
+    if len(tail) >= 2 and is_arithmetic(tail[-1], INVOLUTIONS) and \
+            is_arithmetic(tail[-2], (tail[-1].arg1,)):
+        return 2, []
+    return None
+
+
+def fuse_comparison_branch(tail: typing.List[Command]) \
+        -> typing.Optional[typing.Tuple[int, typing.List[Command]]]:
+    """lt; if-goto L -> jump to L if x < y, and
+    lt; not; if-goto L -> jump to L if x >= y
+    """
+    if len(tail) < 2 or tail[-1].opcode != C_IF:
+        return None
+    label = tail[-1].arg1
+    if is_arithmetic(tail[-2], COMPARISONS):
+        condition = tail[-2].arg1
+        consumed = 2
+    elif len(tail) >= 3 and is_arithmetic(tail[-2], ("not",)) and \
+            is_arithmetic(tail[-3], COMPARISONS):
+        condition = NEGATIONS[tail[-3].arg1]
+        consumed = 3
+    else:
+        return None
+    return consumed, [Command(C_IF_COMPARISON, label,
+                              CONDITIONS.index(condition))]
+
+
+def fuse_not_branch(tail: typing.List[Command]) \
+        -> typing.Optional[typing.Tuple[int, typing.List[Command]]]:
+    """not; if-goto L -> jump to L unless the value is -1"""
+    if len(tail) >= 2 and tail[-1].opcode == C_IF and \
+            is_arithmetic(tail[-2], ("not",)):
+        return 2, [Command(C_IF_NOT, tail[-1].arg1, 0)]
+    return None
+
+
+# The rule table. Whenever a command is added, the rules are applied to the
+# end of the pending commands until none of them matches.
+RULES = [
+    fold_binary,
+    fold_unary,
+    specialize_constant_operand,
+    merge_constant_operands,
+    cancel_push_pop,
+    cancel_involution,
+    fuse_comparison_branch,
+    fuse_not_branch,
+]
+
+
+def optimize_commands(commands: typing.Iterable[Command],
+                      rules: typing.Optional[typing.List[Rule]] = None) \
+        -> typing.Iterator[Command]:
+    """Simplifies a stream of parsed commands before they are translated:
+    folds arithmetic on constants with the 16-bit wraparound of the Hack
+    ALU, turns arithmetic with a constant operand into C_ARITHMETIC_CONSTANT
+    commands, drops commands that cancel each other out and fuses
+    conditions with the "if-goto" that follows them into C_IF_COMPARISON
+    and C_IF_NOT commands, which never push the boolean.
+
+    Rules only match commands that are adjacent in the stream, and neither
+    labels nor calls ever match, so every rule stays within straight-line
+    code. At most MAX_PENDING commands are held back at any time, so this
+    works on streamed input as well.
+
+    Args:
+        commands (typing.Iterable[Command]): the parsed commands.
+        rules: the rule table to use instead of RULES.
+
+    Returns:
+        typing.Iterator[Command]: the simplified commands.
+    """
+    rules = RULES if rules is None else rules
+    pending = []
+    for command in commands:
+        pending.append(command)
+        matched = True
+        while matched and pending:
+            matched = False
+            for rule in rules:
+                match = rule(pending[-WINDOW_SIZE:])
+                if match is not None:
+                    consumed, replacement = match
+                    # The new commands stand for the line of the first
+                    # command they replace.
+                    line = pending[len(pending) - consumed].line
+                    pending[len(pending) - consumed:] = [
+                        command._replace(line=line) for command in replacement]
+                    matched = True
+                    break
+        while len(pending) >= WINDOW_SIZE and (
+                len(pending) > MAX_PENDING or
+                any(constant(command) is None for command in pending)):
+            yield pending.pop(0)
+    yield from pending
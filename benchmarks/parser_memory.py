@@ -0,0 +1,72 @@
+"""
+Measures the peak memory used while translating generated .vm files of
+growing size, with and without the streaming parser. With --stream the peak
+should stay flat, while the default parser grows with the input.
+
+Usage: python benchmarks/parser_memory.py [--sizes N [N ...]]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Main import translate_file
+
+
+# A loop body that exercises every kind of command.
+COMMANDS = ["push local 0", "push constant 17", "add", "pop local 0",
+            "push argument 1", "push static 3", "lt", "if-goto LOOP",
+            "push that 2", "neg", "pop this 1", "call Bench.leaf 1",
+            "label LOOP", "goto LOOP", "return    // comment"]
+
+
+def generate(path: str, n_lines: int) -> None:
+    """Writes a .vm file with n_lines commands.
+
+    Args:
+        path (str): the file to write.
+        n_lines (int): the number of commands to write.
+    """
+    rng = random.Random(n_lines)
+    with open(path, "w") as vm_file:
+        vm_file.write("function Bench.main 1\n")
+        for _ in range(n_lines):
+            vm_file.write(rng.choice(COMMANDS) + "\n")
+
+
+def measure(path: str, streaming: bool) -> int:
+    """Translates a file and returns the peak memory allocated meanwhile.
+
+    Args:
+        path (str): the .vm file to translate.
+        streaming (bool): whether to use the streaming parser.
+
+    Returns:
+        int: the peak of traced memory, in bytes.
+    """
+    tracemalloc.start()
+    with open(path, "r") as input_file, \
+            open(os.devnull, "w") as output_file:
+        translate_file(input_file, output_file, False, streaming=streaming)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--sizes", type=int, nargs="+",
+                            default=[10000, 100000, 1000000])
+    args = arg_parser.parse_args()
+    print(f"{'lines':>10} {'default (KB)':>14} {'streaming (KB)':>16}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            path = os.path.join(directory, "Bench.vm")
+            generate(path, size)
+            default_peak = measure(path, False)
+            streaming_peak = measure(path, True)
+            print(f"{size:>10} {default_peak // 1024:>14} "
+                  f"{streaming_peak // 1024:>16}")
@@ -0,0 +1,198 @@
+"""
+Checks the StackCachingCodeWriter against the inline templates of the
+CodeWriter, and measures the cycles it saves. Generates expression-heavy
+.vm programs, translates each one with and without stack caching, runs both
+translations in the Emulator until they halt and compares the RAM they
+leave behind: the pointers, the temp segment, the statics and the stack.
+Also checks programs that end with a value still cached, and branches on
+the "not" of values that are not booleans, against the unoptimized inline
+templates. Reports the executed cycles and the ROM size of both
+translations.
+
+Usage: python benchmarks/stack_caching.py [--programs N] [-O LEVEL]
+           [--fast-compares] [--seed SEED]
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import typing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Assembler import assemble
+from Emulator import Emulator
+from Main import translate_commands, write_bootstrap
+from Parser import Parser
+
+BINARY_COMMANDS = ["add", "sub", "and", "or", "eq", "gt", "lt"]
+UNARY_COMMANDS = ["neg", "not", "shiftleft", "shiftright"]
+N_LOCALS = 4
+N_STATICS = 4
+N_STATEMENTS = 40
+LOOP_COUNT = 50
+EXPRESSION_DEPTH = 4
+
+# The RAM that both translations must leave identical: the pointers, the
+# temp segment and the statics. The stack is compared up to SP.
+COMPARED_RAM = [*range(0, 5), *range(5, 13), *range(16, 256)]
+STACK_BASE = 256
+
+# Programs that run past the end of the ROM with a value cached in D, which
+# must still be stored when the commands end.
+TRAILING_PROGRAMS = [
+    "function Sys.init 0\npush constant 7\npop static 0\npush constant 9\n",
+    "function Sys.init 0\npush constant 7\npush constant 9\nadd\n",
+]
+
+# Programs that branch on the "not" of a value that is neither true nor
+# false, which must jump since only "not -1" is false.
+NOT_BRANCH_PROGRAMS = [
+    "function Sys.init 0\npush constant 1\npop static 1\npush static 1\n"
+    "not\nif-goto TAKEN\npush constant 111\npop temp 0\ngoto END\n"
+    "label TAKEN\npush constant 222\npop temp 0\nlabel END\n",
+    "function Sys.init 0\npush constant 0\nnot\npop static 1\n"
+    "push static 1\nnot\nif-goto TAKEN\npush constant 111\npop temp 0\n"
+    "goto END\nlabel TAKEN\npush constant 222\npop temp 0\nlabel END\n",
+]
+
+
+def expression(rng: random.Random, depth: int) -> typing.List[str]:
+    """
+    Args:
+        rng (random.Random): the random generator.
+        depth (int): the maximal depth of the expression tree.
+
+    Returns:
+        typing.List[str]: commands that push the value of a random
+        expression.
+    """
+    if depth == 0 or rng.random() < 0.25:
+        kind = rng.random()
+        if kind < 0.4:
+            value = rng.choice([0, 1, 2, 7, rng.randrange(32768)])
+            return [f"push constant {value}"]
+        if kind < 0.7:
+            return [f"push local {rng.randrange(N_LOCALS)}"]
+        if kind < 0.9:
+            return [f"push static {rng.randrange(N_STATICS)}"]
+        return [f"push temp {rng.randrange(8)}"]
+    if rng.random() < 0.2:
+        return expression(rng, depth - 1) + [rng.choice(UNARY_COMMANDS)]
+    return expression(rng, depth - 1) + expression(rng, depth - 1) + \
+        [rng.choice(BINARY_COMMANDS)]
+
+
+def generate(seed: int) -> str:
+    """Generates a program that evaluates random expressions into locals,
+    statics and temps in a loop, and then halts.
+
+    Args:
+        seed (int): the seed of the random generator.
+
+    Returns:
+        str: the program.
+    """
+    rng = random.Random(seed)
+    lines = ["function Sys.init 0", "call Main.main 0", "pop temp 0",
+             "label HALT", "goto HALT",
+             f"function Main.main {N_LOCALS + 1}",
+             f"push constant {LOOP_COUNT}", f"pop local {N_LOCALS}",
+             "label LOOP"]
+    for statement in range(N_STATEMENTS):
+        lines += expression(rng, EXPRESSION_DEPTH)
+        target = rng.random()
+        if target < 0.15:
+            lines += [f"if-goto SKIP{statement}"] + \
+                expression(rng, 2) + \
+                [f"pop static {rng.randrange(N_STATICS)}",
+                 f"label SKIP{statement}"]
+        elif target < 0.6:
+            lines.append(f"pop local {rng.randrange(N_LOCALS)}")
+        elif target < 0.9:
+            lines.append(f"pop static {rng.randrange(N_STATICS)}")
+        else:
+            lines.append(f"pop temp {rng.randrange(8)}")
+    lines += [f"push local {N_LOCALS}", "push constant 1", "sub",
+              f"pop local {N_LOCALS}", f"push local {N_LOCALS}",
+              "push constant 0", "gt", "if-goto LOOP",
+              "push local 0", "return"]
+    return "\n".join(lines) + "\n"
+
+
+def run(program: str, options: typing.Dict) -> typing.Tuple[
+        typing.List[int], int, int]:
+    """Translates a program and runs it until it halts or runs past the end
+    of the ROM.
+
+    Args:
+        program (str): the .vm program.
+        options (typing.Dict): the keyword arguments of translate_commands.
+
+    Returns:
+        typing.Tuple[typing.List[int], int, int]: the compared RAM, the
+        executed cycles and the ROM size.
+    """
+    assembly = io.StringIO()
+    write_bootstrap(assembly, **options)
+    translate_commands(Parser(io.StringIO(program)), assembly, "Main",
+                       **options)
+    emulator = Emulator(*assemble(assembly.getvalue().splitlines()))
+    emulator.run()
+    if not emulator.halted and emulator.pc < len(emulator.rom):
+        raise RuntimeError("the program did not halt")
+    ram = emulator.ram
+    state = [ram[address] for address in COMPARED_RAM] + \
+        list(ram[STACK_BASE:ram[0]])
+    return state, emulator.cycles, len(emulator.rom)
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--programs", type=int, default=20)
+    arg_parser.add_argument("-O", dest="optimize", type=int,
+                            choices=(0, 1, 2), default=0)
+    arg_parser.add_argument("--fast-compares", action="store_true")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    options = {"optimize": args.optimize, "fast_compares": args.fast_compares}
+    totals = {False: [0, 0], True: [0, 0]}
+    mismatches = 0
+    for seed in range(args.seed, args.seed + args.programs):
+        program = generate(seed)
+        results = {stack_caching: run(program, dict(
+                       options, stack_caching=stack_caching))
+                   for stack_caching in (False, True)}
+        if results[False][0] != results[True][0]:
+            mismatches += 1
+            print(f"seed {seed}: the RAM differs from the inline templates")
+        for stack_caching, (state, cycles, size) in results.items():
+            totals[stack_caching][0] += cycles
+            totals[stack_caching][1] += size
+    fixed_programs = [
+        (f"{kind} program {index}", program)
+        for kind, programs in (("trailing", TRAILING_PROGRAMS),
+                               ("not branch", NOT_BRANCH_PROGRAMS))
+        for index, program in enumerate(programs)]
+    # The stack holds return addresses, which differ between optimization
+    # levels, so only the rest of the RAM is compared with the reference.
+    for name, program in fixed_programs:
+        reference = run(program, dict(options, optimize=0,
+                                      stack_caching=False))
+        if any(run(program, dict(options, stack_caching=stack_caching))[0]
+               [:len(COMPARED_RAM)] != reference[0][:len(COMPARED_RAM)]
+               for stack_caching in (False, True)):
+            mismatches += 1
+            print(f"{name}: the RAM differs from the "
+                  f"unoptimized inline templates")
+    (inline_cycles, inline_size), (cached_cycles, cached_size) = \
+        totals[False], totals[True]
+    print(f"    cycles: {inline_cycles:>10} inline, {cached_cycles:>10} "
+          f"cached ({100 * (1 - cached_cycles / inline_cycles):.1f}% fewer)")
+    print(f"  ROM size: {inline_size:>10} inline, {cached_size:>10} "
+          f"cached ({100 * (1 - cached_size / inline_size):.1f}% smaller)")
+    print(f"mismatches: {mismatches} of "
+          f"{args.programs + len(fixed_programs)} programs")
+    if mismatches:
+        sys.exit(1)
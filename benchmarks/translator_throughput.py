@@ -0,0 +1,279 @@
+"""
+Measures the throughput of the translator on generated .vm programs: the
+Parser and the CodeWriter on their own, and both end-to-end through
+Main.translate_file. Reports lines per second, the peak memory of the
+end-to-end translation and the number of instructions emitted per command
+type, and saves them as JSON. Given the JSON of an earlier run, reports
+the change in throughput and fails if any phase got slower than allowed.
+
+Usage: python benchmarks/translator_throughput.py [--lines N]
+           [--weight CATEGORY=W ...] [-O LEVEL] [--output results.json]
+           [--baseline old.json [--tolerance 0.1]]
+"""
+import argparse
+import collections
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CodeWriter import CodeWriter
+from Main import translate_file, translate_commands
+from Parser import Parser, COMMAND_TYPES
+
+
+# How often each category of commands is generated, relative to the others.
+DEFAULT_WEIGHTS = {"arithmetic": 30, "push": 35, "pop": 20, "branching": 10,
+                   "call": 5}
+
+ARITHMETIC_COMMANDS = ["add", "sub", "neg", "eq", "gt", "lt", "and", "or",
+                       "not", "shiftleft", "shiftright"]
+PUSH_SEGMENTS = ["argument", "local", "static", "constant", "this", "that",
+                 "pointer", "temp"]
+POP_SEGMENTS = [segment for segment in PUSH_SEGMENTS if segment != "constant"]
+SEGMENT_SIZES = {"pointer": 2, "temp": 8, "constant": 32768}
+
+# The number of commands in every generated function.
+FUNCTION_LENGTH = 200
+N_FUNCTIONS_CALLED = 16
+
+
+def generate(n_lines: int, weights: typing.Dict[str, int],
+             seed: int = 0) -> str:
+    """Generates a .vm program.
+
+    Args:
+        n_lines (int): the number of commands to generate.
+        weights (typing.Dict[str, int]): the relative frequency of every
+            category of commands.
+        seed (int): the seed of the random generator.
+
+    Returns:
+        str: the program.
+    """
+    rng = random.Random(seed)
+    categories = list(weights)
+    category_weights = [weights[category] for category in categories]
+    lines = []
+    n_functions = 0
+    labels = []
+    while len(lines) < n_lines:
+        if len(lines) % FUNCTION_LENGTH == 0:
+            if lines:
+                lines.append("return")
+            lines.append(f"function Bench.f{n_functions} 4")
+            n_functions += 1
+            labels = []
+            continue
+        category = rng.choices(categories, category_weights)[0]
+        if category == "arithmetic":
+            lines.append(rng.choice(ARITHMETIC_COMMANDS))
+        elif category == "push":
+            segment = rng.choice(PUSH_SEGMENTS)
+            index = rng.randrange(SEGMENT_SIZES.get(segment, 4))
+            lines.append(f"push {segment} {index}")
+        elif category == "pop":
+            segment = rng.choice(POP_SEGMENTS)
+            index = rng.randrange(SEGMENT_SIZES.get(segment, 4))
+            lines.append(f"pop {segment} {index}")
+        elif category == "branching":
+            kind = rng.choice(["label", "goto", "if-goto"])
+            if kind == "label" or not labels:
+                labels.append(f"L{len(labels)}")
+                lines.append(f"label {labels[-1]}")
+            else:
+                lines.append(f"{kind} {rng.choice(labels)}")
+        else:
+            lines.append(f"call Bench.f{rng.randrange(N_FUNCTIONS_CALLED)} "
+                         f"{rng.randrange(4)}")
+    lines.append("return")
+    return "\n".join(lines) + "\n"
+
+
+class InstructionCounter:
+    """An output stream that counts the instructions written to it, and
+    attributes them to the type of the command being translated.
+    """
+
+    def __init__(self) -> None:
+        self.current_type = "bootstrap"
+        self.counts = collections.Counter()
+
+    def write(self, text: str) -> None:
+        self.counts[self.current_type] += sum(
+            1 for line in text.split("\n") if line and line[0] != "(")
+
+    def count(self, commands: typing.Iterable) -> None:
+        """Translates commands one at a time, flushing the CodeWriter after
+        each one so that all of its output is attributed to the right type.
+        """
+        code_writer = CodeWriter(self)
+        code_writer.set_file_name("Bench")
+        for command in commands:
+            self.current_type = COMMAND_TYPES[command.opcode]
+            code_writer.write_command(command)
+            code_writer.flush()
+
+
+class NullOutput:
+    """An output stream that drops everything written to it."""
+
+    def write(self, text: str) -> None:
+        pass
+
+
+def best_time(function: typing.Callable[[], typing.Any],
+              repeat: int) -> float:
+    """
+    Args:
+        function (typing.Callable[[], typing.Any]): the code to time.
+        repeat (int): how often to run it.
+
+    Returns:
+        float: the shortest run time, in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmarks(path: str, n_lines: int, optimize: int,
+                   repeat: int) -> typing.Dict:
+    """
+    Args:
+        path (str): the generated .vm file.
+        n_lines (int): the number of commands in the file.
+        optimize (int): the optimization level of the CodeWriter and
+            end-to-end phases.
+        repeat (int): how often to run every phase.
+
+    Returns:
+        typing.Dict: the results.
+    """
+    with open(path, "r") as input_file:
+        text = input_file.read()
+    commands = list(Parser(io.StringIO(text)))
+
+    def end_to_end() -> None:
+        with open(path, "r") as input_file:
+            translate_file(input_file, NullOutput(), False, optimize=optimize)
+
+    timings = {
+        "parser": best_time(lambda: list(Parser(io.StringIO(text))), repeat),
+        "code_writer": best_time(
+            lambda: translate_commands(commands, NullOutput(), "Bench",
+                                       optimize=optimize), repeat),
+        "end_to_end": best_time(end_to_end, repeat),
+    }
+
+    tracemalloc.start()
+    end_to_end()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Counted without optimizations, which would move instructions between
+    # commands.
+    counter = InstructionCounter()
+    counter.count(commands)
+    command_counts = collections.Counter(
+        COMMAND_TYPES[command.opcode] for command in commands)
+
+    return {
+        "phases": {phase: {"seconds": seconds,
+                           "lines_per_second": n_lines / seconds}
+                   for phase, seconds in timings.items()},
+        "peak_memory_bytes": peak_memory,
+        "instructions": dict(counter.counts),
+        "instructions_per_command": {
+            command_type: counter.counts[command_type] / count
+            for command_type, count in command_counts.items()},
+    }
+
+
+def compare(results: typing.Dict, baseline: typing.Dict,
+            tolerance: float) -> bool:
+    """Prints the change in throughput against an earlier run.
+
+    Args:
+        results (typing.Dict): the results of this run.
+        baseline (typing.Dict): the results of the earlier run.
+        tolerance (float): the allowed slowdown, e.g. 0.1 for 10%.
+
+    Returns:
+        bool: True if no phase got slower than allowed.
+    """
+    passed = True
+    for phase, result in results["phases"].items():
+        if phase not in baseline["phases"]:
+            continue
+        ratio = result["lines_per_second"] / \
+            baseline["phases"][phase]["lines_per_second"]
+        regressed = ratio < 1 - tolerance
+        passed = passed and not regressed
+        print(f"{phase:>12}: {ratio:6.2f}x the baseline throughput"
+              f"{'  REGRESSION' if regressed else ''}")
+    return passed
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--lines", type=int, default=200000)
+    arg_parser.add_argument(
+        "--weight", action="append", default=[], metavar="CATEGORY=W",
+        help="the relative frequency of a category of commands, one of "
+             + ", ".join(DEFAULT_WEIGHTS))
+    arg_parser.add_argument("-O", dest="optimize", type=int,
+                            choices=(0, 1, 2), default=0)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="save the results to this file")
+    arg_parser.add_argument("--baseline",
+                            help="compare against the results in this file")
+    arg_parser.add_argument("--tolerance", type=float, default=0.1)
+    args = arg_parser.parse_args()
+
+    weights = dict(DEFAULT_WEIGHTS)
+    for weight in args.weight:
+        category, value = weight.split("=", 1)
+        if category not in weights:
+            arg_parser.error(f"unknown category '{category}'")
+        weights[category] = int(value)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "Bench.vm")
+        with open(path, "w") as vm_file:
+            vm_file.write(generate(args.lines, weights, args.seed))
+        results = {
+            "python": platform.python_version(),
+            "lines": args.lines,
+            "weights": weights,
+            "optimize": args.optimize,
+            "seed": args.seed,
+            **run_benchmarks(path, args.lines, args.optimize, args.repeat),
+        }
+
+    for phase, result in results["phases"].items():
+        print(f"{phase:>12}: {result['lines_per_second']:>12,.0f} lines/s "
+              f"({result['seconds']:.3f} s)")
+    print(f"{'peak memory':>12}: {results['peak_memory_bytes'] // 1024} KB")
+    for command_type, count in sorted(results["instructions"].items()):
+        per_command = results["instructions_per_command"].get(command_type)
+        print(f"{command_type:>12}: {count:>10} instructions"
+              + (f" ({per_command:.1f} per command)" if per_command else ""))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            if not compare(results, json.load(baseline_file), args.tolerance):
+                sys.exit(1)